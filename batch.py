@@ -0,0 +1,268 @@
+from random import Random
+from util import *
+
+
+def generate_mine_masks(num_games, d, n, seed=None):
+    """
+    Generates num_games random d x d boards with n mines each, all at once.
+
+    :param num_games: number of boards
+    :param d: dimension of each board
+    :param n: number of mines on each board
+    :param seed: seed for the random numbers, or None for an unseeded run
+    :return: num_games x d x d boolean array, True where there is a mine
+    """
+    rng = np.random.default_rng(seed)
+    # The n smallest of d * d random keys are a uniformly random set of n cells
+    keys = rng.random((num_games, d * d))
+    mines = np.argpartition(keys, n, axis=1)[:, :n] if 0 < n < d * d else np.argsort(keys, axis=1)[:, :n]
+    mine_masks = np.zeros((num_games, d * d), dtype=bool)
+    np.put_along_axis(mine_masks, mines, True, axis=1)
+    return mine_masks.reshape(num_games, d, d)
+
+
+# Stands for a cell that hasn't been reached
+NEVER = np.iinfo(np.int32).max
+
+
+def next_check(times, positions, stride):
+    """
+    BasicAgent goes over the board in passes, checking clues in board order, so the time a clue is checked is
+    pass * stride + position. A clue is checked next in the same pass if it comes after what happened, or else in the
+    following one.
+
+    :param times: times things happened, -1 for before the first pass
+    :param positions: flattened index of each cell
+    :param stride: power of 2 at least the number of cells on the board, so times split with masks
+    :return: time each cell is next checked
+    """
+    return (times & -stride) + positions + np.where(positions > (times & (stride - 1)), 0, stride)
+
+
+def first_come(order, pair_clues, pair_mines, num_mines):
+    """
+    Picks which mine rule matches BasicAgent acts on. It still counts flagged cells as hidden, so once a clue flags a
+    cell, any clue sharing that cell never matches again. A clue flags its hidden neighbors unless a clue that acted
+    before it shares one of them. Clues are settled from the first one on: a clue is dropped once an earlier kept clue
+    shares a hidden mine with it, and kept once no earlier clue sharing one is left unsettled.
+
+    :param order: when each matching clue acts, see next_check
+    :param pair_clues: for every hidden mine next to a matching clue, where the clue is in order
+    :param pair_mines: and a number for the mine, the same for every clue next to it
+    :param num_mines: how many different mines there are
+    :return: boolean array, True for the clues that act
+    """
+    def earliest(clues):
+        # The first of the clues to act around each mine, then the first of those around each clue
+        around_mines = np.full(num_mines, NEVER, dtype=np.int32)
+        chosen = clues[pair_clues]
+        np.minimum.at(around_mines, pair_mines[chosen], order[pair_clues[chosen]])
+        around_clues = np.full(len(order), NEVER, dtype=np.int32)
+        np.minimum.at(around_clues, pair_clues, around_mines[pair_mines])
+        return around_clues
+
+    kept = np.zeros(len(order), dtype=bool)
+    unsettled = np.ones(len(order), dtype=bool)
+    while unsettled.any():
+        after_kept = earliest(kept) < order
+        keep = unsettled & ~after_kept & ~(earliest(unsettled) < order)
+        kept |= keep
+        unsettled &= ~keep & ~after_kept
+    return kept
+
+
+def play_basic(mine_masks, seed=None, guesses=None, rngs=None):
+    """
+    Plays the basic agent's strategy on a whole batch of boards at once. Every game moves in lockstep, one forced guess
+    and one call to BasicAgent.infer per step. Once infer is done no clue's rule matches, so only the cells around the
+    guess and whatever it uncovers can start anything new, and each step only looks at those. The safe rule never
+    depends on flags, so when it reveals each cell is settled first, spreading out from the guess the way Bellman-Ford
+    settles distances. A mine rule then acts at the first check after the last of its clue's safe neighbors is
+    revealed, unless a clue that acted earlier already flagged a mine they share.
+
+    :param mine_masks: num_games x d x d boolean array, True where there is a mine
+    :param seed: seed for the forced guesses, or None for an unseeded run
+    :param guesses: optional list of num_games empty lists, filled with the flattened cells each game guessed, in order
+    :param rngs: optional list of one random.Random per game to draw its guesses from instead, so a game's guesses
+        don't depend on what else is in the batch
+    :return: array holding each game's score, the same score BasicAgent.run would give with the same guesses
+    """
+    num_games, d = len(mine_masks), mine_masks.shape[-1]
+    size = d * d
+    stride = 1 << (size - 1).bit_length()
+    # Every cell's neighbors, the ones off the board pointing at a spare column past the last cell
+    i, j = np.divmod(np.arange(size), d)
+    neighbors = np.stack([np.where((0 <= i + di) & (i + di < d) & (0 <= j + dj) & (j + dj < d), (i + di) * d + j + dj,
+                                   size) for di in [-1, 0, 1] for dj in [-1, 0, 1] if (di, dj) != (0, 0)], axis=1)
+
+    def with_spare(values, fill=0):
+        spare = np.full((len(values), 1), fill, dtype=values.dtype)
+        return np.concatenate([values.reshape(len(values), size), spare], axis=1)
+
+    def spread(counts, games, indices, delta):
+        np.add.at(counts, (games[:, None], neighbors[indices]), delta)
+
+    def around(games, indices):
+        # Every cell next to the given ones, off board neighbors left out, and which of the given ones it is next to
+        games, near, rows = np.repeat(games, 8), neighbors[indices].reshape(-1), np.repeat(np.arange(len(indices)), 8)
+        return games[near < size], near[near < size], rows[near < size]
+
+    def distinct(games, indices):
+        return np.divmod(np.unique(games * size + indices), size)
+
+    # Each game guesses the hidden cells in a random order fixed up front, the first one still hidden in what is left
+    # of it is a uniformly random hidden cell. generate_mine_masks draws from numpy's default generator, so the order is
+    # seeded from random instead, or it would follow the mines
+    rng = Random(seed)
+    guess_order = np.array([np.random.default_rng((rngs[g] if rngs else rng).getrandbits(64)).permutation(size)
+                            for g in range(num_games)])
+    next_guess = np.zeros(num_games, dtype=np.intp)
+
+    # Games still in the batch, and for each of their cells the clue, how many neighbors are flagged, exploded, hidden
+    # and safe, or hidden mines, and when the current call to infer reveals it
+    ids = np.arange(num_games)
+    masks = with_spare(mine_masks)
+    clues = neighbor_sum(mine_masks).reshape(num_games, size)
+    cells = np.full((num_games, size), HIDDEN, dtype=np.int8)
+    num_flagged = with_spare(np.zeros((num_games, size), dtype=np.int8))
+    num_exploded = num_flagged.copy()
+    num_hidden_safe = with_spare(neighbor_sum(~mine_masks))
+    num_hidden_mines = with_spare(clues)
+    times = with_spare(np.full((num_games, size), NEVER, dtype=np.int32), NEVER)
+    num_hidden = np.full(num_games, size)
+    scores = np.ones(num_games)
+
+    while len(ids) > 0:
+        # Every game that isn't done makes a forced guess
+        g = np.flatnonzero(num_hidden > 0)
+        k = np.empty(len(g), dtype=np.intp)
+        todo = np.arange(len(g))
+        while len(todo) > 0:
+            window = np.minimum(next_guess[g[todo], None] + np.arange(16), size - 1)
+            candidates = guess_order[g[todo, None], window]
+            still_hidden = cells[g[todo, None], candidates] == HIDDEN
+            first = still_hidden.argmax(axis=1)
+            found = still_hidden[np.arange(len(todo)), first]
+            k[todo[found]] = candidates[found, first[found]]
+            next_guess[g[todo]] = window[np.arange(len(todo)), np.where(found, first, 15)] + ~found
+            todo = todo[~found]
+        mined = masks[g, k]
+        cells[g, k] = np.where(mined, EXPLODED, clues[g, k])
+        num_hidden[g] -= 1
+        spread(num_exploded, g[mined], k[mined], 1)
+        spread(num_hidden_mines, g[mined], k[mined], -1)
+        spread(num_hidden_safe, g[~mined], k[~mined], -1)
+        if guesses is not None:
+            for h, index in zip(g, k):
+                guesses[ids[h]].append(int(index))
+
+        # every hidden neighbor is safe: basic_rule gives CLEAR once the clue equals its exploded neighbors. Only a safe
+        # guess or the clues around an exploded one can have one that reveals something
+        touched_g, touched_k, _ = around(g, k)
+        touched_g, touched_k = np.concatenate([g, touched_g]), np.concatenate([k, touched_k])
+        at = (touched_g, touched_k)
+        empty = (cells[at] <= 8) & (clues[at] == num_exploded[at]) & (num_hidden_safe[at] > 0)
+        source_g, source_k = touched_g[empty], touched_k[empty]
+        reached_g, reached_k = [], []
+        while len(source_g) > 0:
+            # Each hidden safe cell next to a clue that says so is revealed the first time any of those clues is checked
+            checked = times[source_g, source_k]
+            checks = next_check(np.where(checked == NEVER, -1, checked), source_k, stride)
+            h, near, rows = around(source_g, source_k)
+            checks = checks[rows]
+            hidden_safe = (cells[h, near] == HIDDEN) & ~masks[h, near]
+            h, near, checks = h[hidden_safe], near[hidden_safe], checks[hidden_safe]
+            before = times[h, near]
+            np.minimum.at(times, (h, near), checks)
+            improved = (checks < before) & (checks == times[h, near])
+            h, near = distinct(h[improved], near[improved])
+            reached_g.append(h)
+            reached_k.append(near)
+            empty = clues[h, near] == num_exploded[h, near]
+            source_g, source_k = h[empty], near[empty]
+        if reached_g:
+            u_g, u_k = distinct(np.concatenate(reached_g), np.concatenate(reached_k))
+            cells[u_g, u_k] = clues[u_g, u_k]
+            num_hidden -= np.bincount(u_g, minlength=len(ids))
+            spread(num_hidden_safe, u_g, u_k, -1)
+            around_g, around_k, _ = around(u_g, u_k)
+            touched_g = np.concatenate([touched_g, u_g, around_g])
+            touched_k = np.concatenate([touched_k, u_k, around_k])
+
+        # every hidden neighbor is a mine: basic_rule gives FLAGGED once every safe hidden neighbor is revealed, as long
+        # as none of the clue's neighbors is flagged. A clue that matched before this step has flagged already, so only
+        # the touched ones need checking
+        g, k = distinct(touched_g, touched_k)
+        match = ((cells[g, k] <= 8) & (num_flagged[g, k] == 0) & (num_hidden_safe[g, k] == 0)
+                 & (num_hidden_mines[g, k] > 0))
+        g, k = g[match], k[match]
+        if len(g) > 0:
+            # A clue acts at its first check after it and its last safe neighbor are revealed
+            near = np.concatenate([k[:, None], neighbors[k]], axis=1)
+            revealed_at = times[g[:, None], near]
+            revealed_at = np.where((revealed_at == NEVER) | masks[g[:, None], near], -1, revealed_at)
+            order = next_check(revealed_at.max(axis=1), k, stride)
+            h, mine, clue = around(g, k)
+            hidden_mine = (cells[h, mine] == HIDDEN) & masks[h, mine]
+            h, mine, clue = h[hidden_mine], mine[hidden_mine], clue[hidden_mine]
+            mines, pair_mines = np.unique(h * size + mine, return_inverse=True)
+            keep = first_come(order, clue, pair_mines, len(mines))
+            g, k = np.divmod(mines[np.unique(pair_mines[keep[clue]])], size)
+            cells[g, k] = FLAGGED
+            num_hidden -= np.bincount(g, minlength=len(ids))
+            spread(num_flagged, g, k, 1)
+            spread(num_hidden_mines, g, k, -1)
+        if reached_g:
+            times[u_g, u_k] = NEVER
+
+        done = num_hidden == 0
+        if 4 * np.count_nonzero(done) >= len(ids):
+            # Finished games are scored and dropped once they make up a good part of the batch
+            num_mines = masks[done, :size].sum(axis=1)
+            num_correctly_flagged_mines = ((cells[done] == FLAGGED) & masks[done, :size]).sum(axis=1)
+            scores[ids[done]] = np.where(num_mines == 0, 1, num_correctly_flagged_mines / np.maximum(num_mines, 1))
+            live = ~done
+            ids, masks, clues, cells, num_hidden = ids[live], masks[live], clues[live], cells[live], num_hidden[live]
+            num_flagged, num_exploded = num_flagged[live], num_exploded[live]
+            num_hidden_safe, num_hidden_mines = num_hidden_safe[live], num_hidden_mines[live]
+            times, guess_order, next_guess = times[live], guess_order[live], next_guess[live]
+    return scores
+
+
+def check_against_basic_agent(num_games, d, n, seed=0):
+    """
+    Checks the batch engine against BasicAgent on seeded boards. Each game's forced guesses are replayed into a
+    BasicAgent, which has to reach the same board and score. A guess that BasicAgent sees as already uncovered means
+    the two disagree on what can be deduced.
+
+    :param num_games: number of boards to check
+    :param d: dimension of each board
+    :param n: number of mines on each board
+    :param seed: seed for the boards and the guesses
+    :return: list of the games that don't match
+    """
+    mine_masks = generate_mine_masks(num_games, d, n, seed)
+    guesses = [[] for _ in range(num_games)]
+    scores = play_basic(mine_masks, seed, guesses)
+
+    mismatches = []
+    for g in range(num_games):
+        mines = set(map(tuple, np.argwhere(mine_masks[g]).tolist()))
+        agent = BasicAgent(Board(d, mines), mines)
+        matched = True
+        for index in guesses[g]:
+            agent.infer()
+            if agent.board.cells.reshape(-1)[index] != HIDDEN:
+                matched = False
+                break
+            agent.reveal(index)
+        agent.infer()
+        agent.score = get_score(agent.board, agent.mines)
+        if not matched or not completed(agent.board) or agent.score != scores[g]:
+            mismatches.append(g)
+    return mismatches
+
+
+if __name__ == "__main__":
+    for density in [0.05, 0.1, 0.15, 0.2, 0.25, 0.3]:
+        print(density, check_against_basic_agent(200, 16, round(16 * 16 * density), seed=1))
@@ -0,0 +1,261 @@
+import argparse
+import json
+import platform
+import random
+import time
+from util import *
+from linalg import BACKENDS
+
+# Boards and densities the end to end benchmarks play
+DIMENSIONS = [10, 20, 30]
+DENSITIES = [0.1, 0.15, 0.2]
+
+
+def percentile(samples, q):
+    """
+    :param samples: sorted list of numbers
+    :param q: percentile between 0 and 100
+    :return: the q-th percentile, interpolating between samples
+    """
+    position = (len(samples) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (position - low)
+
+
+def summarize(samples):
+    """
+    Turns the time taken by each run of a benchmark into its summary.
+
+    :param samples: seconds taken by each run
+    :return: dictionary of runs per second and percentiles in milliseconds
+    """
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'ops_per_sec': len(samples) / sum(samples) if sum(samples) > 0 else float('inf'),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p90_ms': percentile(samples, 90) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+def time_runs(setup, run, repeat):
+    """
+    Times run(setup()) repeat times, leaving the setup out of the timings.
+
+    :param setup: function making the input of one run, given the run number
+    :param run: function to time
+    :param repeat: number of runs
+    :return: list of seconds taken by each run
+    """
+    samples = []
+    for k in range(repeat):
+        arg = setup(k)
+        start = time.perf_counter()
+        run(arg)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def game_benchmarks(repeat, seed):
+    """
+    Plays seeded games end to end with each agent over a grid of dimensions and densities.
+
+    :param repeat: number of games per agent, dimension and density
+    :param seed: base seed, game k of a grid point uses seed + k
+    :return: dictionary from benchmark name to its samples
+    """
+    results = {}
+    for d in DIMENSIONS:
+        for density in DENSITIES:
+            n = round(d * d * density)
+            results['basic_run[d=%d,p=%.2f]' % (d, density)] = time_runs(
+                lambda k: BasicAgent(d, n, random.Random(seed + k)), lambda agent: agent.run(), repeat)
+            results['improved_run[d=%d,p=%.2f]' % (d, density)] = time_runs(
+                lambda k: ImprovedAgent(d, n, (-1, False), rng=random.Random(seed + k)), lambda agent: agent.run(),
+                repeat)
+    return results
+
+
+def solver_states(d, n, seed, count):
+    """
+    Plays seeded ImprovedAgent games and records the clues it had each time it was forced to guess. These are the
+    positions where the solver did the most work and still found nothing.
+
+    :param d: board dimension
+    :param n: number of mines
+    :param seed: seed of the first game
+    :param count: number of positions to record
+    :return: list of positions, each a list of (number of mines, bitset of hidden cells) clues
+    """
+    states = []
+    game_seed = seed
+    while len(states) < count:
+        agent = ImprovedAgent(d, n, (-1, True), rng=random.Random(game_seed))
+        game_seed += 1
+        while not completed(agent.board) and len(states) < count:
+            agent.infer()
+            if completed(agent.board):
+                break
+            clues = [(clue.num_mines, clue.hidden) for clue in agent.solver.clues.values()]
+            if clues:
+                states.append(clues)
+            agent.board, (i, j) = random_query(agent.board, agent.mines, agent.rng)
+            agent.update((i, j))
+    return states
+
+
+def build_solver(d, clues, backend=DEFAULT_BACKEND):
+    """
+    :param d: board dimension
+    :param clues: list of (number of mines, bitset of hidden cells) clues
+    :param backend: name of the row reduction backend
+    :return: new ClueSolver holding the clues
+    """
+    solver = ClueSolver(d, (-1, True), backend)
+    for num_mines, hidden_cells in clues:
+        solver.add_clue(num_mines, hidden_cells, 0)
+    return solver
+
+
+def solver_benchmarks(repeat, seed):
+    """
+    Times the neighbor lookups and the clue solver's hot paths on seeded inputs.
+
+    :param repeat: number of runs per benchmark
+    :param seed: seed for the inputs
+    :return: dictionary from benchmark name to its samples
+    """
+    results = {}
+    rng = random.Random(seed)
+    d = 30
+    coordinates = [(rng.randrange(d), rng.randrange(d)) for _ in range(1000)]
+
+    def neighbors(cells):
+        for cell in cells:
+            get_neighbor_coordinates(cell, d)
+
+    results['get_neighbor_coordinates[x1000]'] = time_runs(lambda k: coordinates, neighbors, repeat)
+
+    states = solver_states(d, round(d * d * 0.2), seed, repeat)
+
+    def reduced_solver(k):
+        solver = build_solver(d, states[k])
+        solver.generate_sympy()
+        return solver
+
+    for backend in BACKENDS:
+        results['generate_sympy[%s]' % backend] = time_runs(lambda k: build_solver(d, states[k], backend),
+                                                            ClueSolver.generate_sympy, repeat)
+    results['solve_improved'] = time_runs(lambda k: build_solver(d, states[k]), ClueSolver.solve_improved, repeat)
+    results['get_next_cell'] = time_runs(reduced_solver, ClueSolver.get_next_cell, repeat)
+    return results
+
+
+def check_backends(num_games, d, n, seed=0):
+    """
+    Checks every row reduction backend gives the same deductions as sympy. Seeded games are played once per backend
+    with each way of running the improved agent and have to end on the same board after the same guesses, and the
+    positions where the agent got stuck have to give the same solution and next cell when solved from scratch.
+
+    :param num_games: number of games per way of running the agent
+    :param d: board dimension
+    :param n: number of mines
+    :param seed: seed of the first game
+    :return: list of (backend, what differed) pairs, empty if every backend matches
+    """
+    mismatches = []
+    for info in [(-1, False), (n, False), (-1, True)]:
+        for k in range(num_games):
+            games = {}
+            for backend in BACKENDS:
+                agent = ImprovedAgent(d, n, info, rng=random.Random(seed + k), backend=backend)
+                agent.run()
+                games[backend] = (agent.board.cells.tobytes(), agent.score, agent.num_guesses)
+            mismatches.extend((backend, 'game %d with info %s' % (seed + k, info))
+                              for backend, game in games.items() if game != games['sympy'])
+
+    for k, clues in enumerate(solver_states(d, n, seed, num_games)):
+        solutions = {}
+        for backend in BACKENDS:
+            solution, next_cell = build_solver(d, clues, backend).solve_improved()
+            solutions[backend] = (solution.mine_bits, solution.safe_bits, next_cell)
+        mismatches.extend((backend, 'position %d' % k)
+                          for backend, solution in solutions.items() if solution != solutions['sympy'])
+    return mismatches
+
+
+def run_benchmarks(repeat=20, seed=0):
+    """
+    Runs every benchmark.
+
+    :param repeat: number of runs per benchmark
+    :param seed: seed for every board and guess
+    :return: dictionary with what the benchmarks ran on and each benchmark's summary
+    """
+    samples = game_benchmarks(repeat, seed)
+    samples.update(solver_benchmarks(repeat, seed))
+    return {
+        'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                 'repeat': repeat, 'seed': seed},
+        'benchmarks': {name: summarize(s) for name, s in samples.items()},
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compares a benchmark run against a saved baseline.
+
+    :param current: result of run_benchmarks
+    :param baseline: an earlier result of run_benchmarks
+    :param threshold: how much slower the median can get before it counts as a regression, 0.1 is 10%
+    :return: list of (name, baseline p50, current p50, ratio, whether it regressed) for every benchmark in both,
+        slowest ratio first
+    """
+    rows = []
+    for name, summary in current['benchmarks'].items():
+        if name in baseline['benchmarks']:
+            before = baseline['benchmarks'][name]['p50_ms']
+            ratio = summary['p50_ms'] / before if before > 0 else float('inf')
+            rows.append((name, before, summary['p50_ms'], ratio, ratio > 1 + threshold))
+    rows.sort(key=lambda row: -row[3])
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Seeded benchmarks for the agents and the clue solver')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed for every board and guess')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1, help='median slowdown that counts as a regression')
+    parser.add_argument('--check-backends', action='store_true',
+                        help='check every row reduction backend deduces the same as sympy instead of timing')
+    args = parser.parse_args()
+
+    if args.check_backends:
+        mismatches = []
+        for d, density in [(10, 0.15), (16, 0.2), (30, 0.2)]:
+            mismatches += check_backends(args.repeat, d, round(d * d * density), args.seed)
+        for backend, what in mismatches:
+            print('%s differs on %s' % (backend, what))
+        print('%d mismatches' % len(mismatches))
+        raise SystemExit(1 if mismatches else 0)
+
+    result = run_benchmarks(args.repeat, args.seed)
+    for name, summary in result['benchmarks'].items():
+        print('%-32s %10.1f ops/s  p50 %9.3f ms  p90 %9.3f ms  p99 %9.3f ms' % (
+            name, summary['ops_per_sec'], summary['p50_ms'], summary['p90_ms'], summary['p99_ms']))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for name, before, after, ratio, regressed in compare(result, baseline, args.threshold):
+            regressions += regressed
+            print('%-32s %9.3f ms -> %9.3f ms  x%.2f%s' % (name, before, after, ratio,
+                                                          '  REGRESSION' if regressed else ''))
+        raise SystemExit(1 if regressions else 0)
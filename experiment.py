@@ -0,0 +1,339 @@
+import concurrent.futures
+import json
+import math
+import os
+import random
+from util import *
+import batch
+import patterndb
+from instrument import JsonLinesSink, Tagged
+
+# Every agent a sweep can run, built from the board dimension, number of mines, random number generator and trace sink.
+# The basic agent has nothing to trace.
+AGENTS = {
+    'basic': lambda d, n, rng, sink=None: BasicAgent(d, n, rng),
+    'improved': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (-1, False), rng=rng, sink=sink),
+    # Bonus: Global Mine Information
+    'global': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (n, False), rng=rng, sink=sink),
+    # Bonus: Optimized Selection Algorithm
+    'selection': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (-1, True), rng=rng, sink=sink),
+    'risk': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (-1, False), min_risk=True, rng=rng, sink=sink),
+    # Global mine information with the matrix size capped
+    'budget': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (n, False), rng=rng, sink=sink, max_cells=64),
+    # Needs patterns.db from python patterndb.py build, each worker maps it once and they all share its pages
+    'windows': lambda d, n, rng, sink=None: ImprovedAgent(d, n, (-1, False), rng=rng, sink=sink,
+                                                         pattern_db=patterndb.load()),
+}
+
+
+def trial_seed(d, n, trial):
+    """
+    Every agent gets the same seed for the same trial, so they all play the same board.
+
+    :param d: board dimension
+    :param n: number of mines
+    :param trial: trial number
+    :return: seed for the trial
+    """
+    return (d * 1000003 + n) * 1000003 + trial
+
+
+def play_trial(agent, d, n, seed=None, sink=None):
+    """
+    Plays a single minesweeper game.
+
+    :param agent: name of the agent in AGENTS
+    :param d: board dimension
+    :param n: number of mines
+    :param seed: seed for the board and guesses, or None for an unseeded game
+    :param sink: where to send the game's trace events, or None to not trace
+    :return: the agent's score
+    """
+    game = AGENTS[agent](d, n, random.Random(seed), sink)
+    game.run()
+    return game.score
+
+
+def play_basic_trials(trials):
+    """
+    Plays basic agent trials together with batch.play_basic, one batch per board dimension. Each trial plays the same
+    board as every other agent, and draws its guesses from its own seed, so its score doesn't depend on which other
+    trials share its batch.
+
+    :param trials: list of basic agent trial dictionaries
+    :return: dictionary from the id of each trial to its score
+    """
+    scores = {}
+    for d in sorted(set(trial['dim'] for trial in trials)):
+        group = [trial for trial in trials if trial['dim'] == d]
+        rngs = [random.Random(trial_seed(d, trial['mines'], trial['trial'])) for trial in group]
+        masks = np.array([generate_board(d, trial['mines'], rng)[0].mine_mask for trial, rng in zip(group, rngs)])
+        for trial, score in zip(group, batch.play_basic(masks, rngs=rngs)):
+            scores[id(trial)] = float(score)
+    return scores
+
+
+def run_chunk(trials, trace_dir=None):
+    """
+    Plays a group of trials in one worker, so the cost of sending work to a process is shared between them.
+
+    :param trials: list of trial dictionaries
+    :param trace_dir: folder to write trace events to, one file per worker process, or None to not trace
+    :return: the same trials, each with its score added
+    """
+    sink = JsonLinesSink(os.path.join(trace_dir, 'trace-%d.jsonl' % os.getpid())) if trace_dir else None
+    try:
+        # The basic agent has nothing to trace, so its trials all go through the batch engine
+        scores = play_basic_trials([trial for trial in trials if trial['agent'] == 'basic'])
+        return [dict(trial, score=scores[id(trial)] if id(trial) in scores else
+                     play_trial(trial['agent'], trial['dim'], trial['mines'],
+                                trial_seed(trial['dim'], trial['mines'], trial['trial']),
+                                Tagged(sink, **trial) if sink else None))
+                for trial in trials]
+    finally:
+        if sink:
+            sink.close()
+
+
+def sweep_trials(agents, dim, p_steps, num_trials):
+    """
+    Lists every trial of a density sweep. Trials are ordered by trial number first, so any run of consecutive trials
+    covers a spread of densities and takes about as long as any other.
+
+    :param agents: names of the agents to run
+    :param dim: board dimension
+    :param p_steps: number of densities to test
+    :param num_trials: number of trials per agent and density
+    :return: list of trial dictionaries
+    """
+    trials = []
+    for trial in range(num_trials):
+        for p in range(p_steps):
+            for agent in agents:
+                trials.append({'agent': agent, 'dim': dim, 'mines': round(dim * dim * p / p_steps),
+                               'density': p / p_steps, 'trial': trial})
+    return trials
+
+
+def trial_key(trial):
+    """
+    :param trial: trial dictionary, with or without a score
+    :return: what identifies the trial in a results file
+    """
+    return trial['agent'], trial['dim'], trial['mines'], trial['trial']
+
+
+def load_results(path):
+    """
+    Reads every finished trial from a results file. A line cut short by a crash is skipped.
+
+    :param path: results file, one JSON object per line
+    :return: list of trial dictionaries with scores
+    """
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def open_results(path):
+    """
+    Opens a results file to append to. A crash can leave the last line unfinished, so that line is ended first.
+
+    :param path: results file, one JSON object per line
+    :return: the file, open for appending
+    """
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+    else:
+        needs_newline = False
+    f = open(path, 'a')
+    if needs_newline:
+        f.write('\n')
+    return f
+
+
+def run_sweep(path, agents, dim, p_steps, num_trials, chunk_size=10, max_workers=None, trace_dir=None):
+    """
+    Runs a density sweep, appending each trial's result to a results file as soon as its chunk finishes. Trials already
+    in the file are not run again, so an interrupted sweep picks up where it stopped.
+
+    :param path: results file, one JSON object per line
+    :param agents: names of the agents to run
+    :param dim: board dimension
+    :param p_steps: number of densities to test
+    :param num_trials: number of trials per agent and density
+    :param chunk_size: number of trials each worker plays per task
+    :param max_workers: number of worker processes, one per CPU if not given
+    :param trace_dir: folder to write each game's trace events to, or None to not trace
+    :return: number of trials run
+    """
+    done = set(trial_key(result) for result in load_results(path))
+    pending = [trial for trial in sweep_trials(agents, dim, p_steps, num_trials) if trial_key(trial) not in done]
+    if not pending:
+        return 0
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor, \
+            open_results(path) as f:
+        futures = [executor.submit(run_chunk, chunk, trace_dir) for chunk in chunks]
+        for future in concurrent.futures.as_completed(futures):
+            for result in future.result():
+                f.write(json.dumps(result) + '\n')
+            f.flush()
+    return len(pending)
+
+
+class RunningStats:
+    def __init__(self):
+        """
+        Mean and variance of a stream of scores, updated one score at a time with Welford's algorithm, which keeps
+        three numbers instead of every score and doesn't lose precision to cancellation the way summing squares does.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        """
+        :param x: the next score
+        :return: nothing
+        """
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """
+        :return: sample variance, 0 until there are two scores
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def half_width(self, z=1.96):
+        """
+        :param z: standard normal quantile of the confidence level, 1.96 for 95%
+        :return: half the width of the normal confidence interval of the mean, infinite until there are two scores
+        """
+        return z * math.sqrt(self.variance / self.count) if self.count > 1 else math.inf
+
+    def trials_wanted(self, target, min_trials, max_trials, z=1.96):
+        """
+        How many scores the mean needs for its confidence interval to be at most target either side, going by the
+        variance so far. At most doubles what there is, as the variance of a few scores is a rough guess.
+
+        :param target: widest half width to accept
+        :param min_trials: fewest scores to have before trusting the variance
+        :param max_trials: most scores to ever want
+        :param z: standard normal quantile of the confidence level
+        :return: total number of scores wanted, counting those there are
+        """
+        if self.count < min_trials:
+            return min_trials
+        if self.half_width(z) <= target:
+            return self.count
+        needed = math.ceil(self.variance * (z / target) ** 2)
+        return min(max(needed, self.count + 1), 2 * self.count, max_trials)
+
+
+def run_adaptive_sweep(path, agents, dim, p_steps, target=0.02, min_trials=10, max_trials=200, z=1.96,
+                       chunk_size=10, max_workers=None, trace_dir=None):
+    """
+    Runs a density sweep that plays more trials only where they are needed. Every agent and density starts with
+    min_trials trials, and each score is folded into a RunningStats as soon as it comes back. Whenever a confidence
+    interval is still wider than target either side, more trials are queued for it, up to max_trials, so densities
+    where every game ends the same way stop early and the ones in between get the trials. Results go to the same kind
+    of file as run_sweep, and trials already in it count, so an interrupted sweep picks up where it stopped.
+
+    Trial k always plays the same board, but how many trials a density ends up with can depend on the order results
+    come back in.
+
+    :param path: results file, one JSON object per line
+    :param agents: names of the agents to run
+    :param dim: board dimension
+    :param p_steps: number of densities to test
+    :param target: widest confidence interval half width to accept for a mean score
+    :param min_trials: trials to play for every agent and density before looking at the variance
+    :param max_trials: most trials to play for any agent and density
+    :param z: standard normal quantile of the confidence level, 1.96 for 95%
+    :param chunk_size: most trials each worker plays per task
+    :param max_workers: number of worker processes, one per CPU if not given
+    :param trace_dir: folder to write each game's trace events to, or None to not trace
+    :return: dictionary from (agent, density) to its RunningStats
+    """
+    cells = [(agent, round(dim * dim * p / p_steps), p / p_steps) for p in range(p_steps) for agent in agents]
+    stats = {(agent, mines): RunningStats() for agent, mines, _ in cells}
+    # Trial numbers finished or queued for each agent and number of mines
+    taken = {key: set() for key in stats}
+    for result in load_results(path):
+        key = result['agent'], result['mines']
+        if result['dim'] == dim and key in stats and result['trial'] not in taken[key]:
+            taken[key].add(result['trial'])
+            stats[key].add(result['score'])
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+
+    def schedule():
+        trials = []
+        for agent, mines, density in cells:
+            key = agent, mines
+            wanted = stats[key].trials_wanted(target, min_trials, max_trials, z)
+            trial = 0
+            while len(taken[key]) < wanted:
+                while trial in taken[key]:
+                    trial += 1
+                taken[key].add(trial)
+                trials.append({'agent': agent, 'dim': dim, 'mines': mines, 'density': density, 'trial': trial})
+        return set(executor.submit(run_chunk, trials[i:i + chunk_size], trace_dir)
+                   for i in range(0, len(trials), chunk_size))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor, \
+            open_results(path) as f:
+        futures = schedule()
+        while futures:
+            finished, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                for result in future.result():
+                    f.write(json.dumps(result) + '\n')
+                    stats[result['agent'], result['mines']].add(result['score'])
+            f.flush()
+            futures |= schedule()
+    return {(agent, density): stats[agent, mines] for agent, mines, density in cells}
+
+
+def score_stats(results, agents):
+    """
+    Collects the scores of a sweep for each agent and density.
+
+    :param results: list of trial dictionaries with scores
+    :param agents: names of the agents to collect
+    :return: dictionary from agent name to a sorted list of (density, RunningStats) pairs
+    """
+    stats = {}
+    for result in results:
+        if result['agent'] in agents:
+            stats.setdefault(result['agent'], {}).setdefault(result['density'], RunningStats()).add(result['score'])
+    return {agent: sorted(stats.get(agent, {}).items()) for agent in agents}
+
+
+def mean_scores(results, agents):
+    """
+    Averages the scores of a sweep for each agent and density.
+
+    :param results: list of trial dictionaries with scores
+    :param agents: names of the agents to average
+    :return: dictionary from agent name to a sorted list of (density, mean score) pairs
+    """
+    return {agent: [(density, stats.mean) for density, stats in points]
+            for agent, points in score_stats(results, agents).items()}
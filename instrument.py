@@ -0,0 +1,86 @@
+import itertools
+import json
+import os
+
+# Counters ImprovedAgent records for each call to infer
+INFER_FIELDS = ['solves', 'clues', 'basic', 'windows', 'pairwise', 'improved', 'global', 'pattern_hits', 'groups',
+                'rows', 'cols', 'rref_s', 'skipped', 'parallel']
+
+_game_ids = itertools.count()
+
+
+def new_game_id():
+    """
+    :return: id for a traced game, unique across the worker processes of a sweep
+    """
+    return '%d-%d' % (os.getpid(), next(_game_ids))
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        """
+        Writes every event as one line of JSON, appending to the file.
+
+        :param path: file to write to
+        """
+        self.file = open(path, 'a')
+
+    def emit(self, event):
+        self.file.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Aggregator:
+    def __init__(self):
+        """
+        Keeps running totals of the numeric fields of every event instead of the events themselves, grouped by the
+        event's type. Memory stays the same however many games are traced.
+        """
+        self.counts = {}
+        self.totals = {}
+        self.maxima = {}
+
+    def emit(self, event):
+        kind = event.get('event')
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        totals = self.totals.setdefault(kind, {})
+        maxima = self.maxima.setdefault(kind, {})
+        for field, value in event.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals[field] = totals.get(field, 0) + value
+                maxima[field] = max(maxima.get(field, value), value)
+            elif isinstance(value, bool):
+                totals[field] = totals.get(field, 0) + value
+
+    def close(self):
+        pass
+
+    def summary(self):
+        """
+        :return: dictionary from event type to its count, and the total, mean and maximum of each numeric field
+        """
+        return {kind: {'count': count,
+                       'total': self.totals[kind],
+                       'mean': {field: total / count for field, total in self.totals[kind].items()},
+                       'max': self.maxima[kind]}
+                for kind, count in self.counts.items()}
+
+
+class Tagged:
+    def __init__(self, sink, **fields):
+        """
+        Adds the same fields to every event before passing it on, such as which trial of a sweep it came from.
+
+        :param sink: sink to pass events to
+        :param fields: fields to add
+        """
+        self.sink = sink
+        self.fields = fields
+
+    def emit(self, event):
+        self.sink.emit(dict(self.fields, **event))
+
+    def close(self):
+        self.sink.close()
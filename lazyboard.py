@@ -0,0 +1,313 @@
+import random
+import time
+from collections import deque
+from util import *
+
+MASK64 = (1 << 64) - 1
+
+
+def mix64(x):
+    """
+    Scrambles a 64 bit number, the finalizer of splitmix64.
+
+    :param x: number below 2 ** 64
+    :return: scrambled number below 2 ** 64
+    """
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+    return x ^ (x >> 31)
+
+
+class FeistelPermutation:
+    def __init__(self, size, seed=None, rounds=4):
+        """
+        A seeded shuffle of range(size) that can be evaluated one element at a time, in either direction, without
+        storing it. A Feistel network is a permutation of the smallest even power of two at least size, and values
+        that land outside range(size) are put through it again until they land inside.
+
+        :param size: number of elements to shuffle
+        :param seed: seed for the shuffle, or None for an unseeded one
+        :param rounds: number of Feistel rounds
+        """
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(64) for _ in range(rounds)]
+
+    def forward(self, x):
+        """
+        :param x: element of range(size)
+        :return: where x is shuffled to
+        """
+        while True:
+            left, right = x >> self.half_bits, x & self.half_mask
+            for key in self.keys:
+                left, right = right, left ^ (mix64((right + key) & MASK64) & self.half_mask)
+            x = (left << self.half_bits) | right
+            if x < self.size:
+                return x
+
+    def inverse(self, y):
+        """
+        :param y: element of range(size)
+        :return: the element that is shuffled to y
+        """
+        while True:
+            left, right = y >> self.half_bits, y & self.half_mask
+            for key in reversed(self.keys):
+                left, right = right ^ (mix64((left + key) & MASK64) & self.half_mask), left
+            y = (left << self.half_bits) | right
+            if y < self.size:
+                return y
+
+
+class LazyBoard:
+    def __init__(self, d, n, seed=None):
+        """
+        A d x d board with n mines where nothing is worked out until it is needed. Cells are shuffled with a seeded
+        FeistelPermutation and the cells shuffled into the first n places are the mines, so there are exactly n of
+        them and checking one cell takes a few hash rounds. Only the cells that have been revealed or flagged are
+        stored, which makes boards far too big to hold in memory playable.
+
+        :param d: dimension of board
+        :param n: number of mines
+        :param seed: seed for where the mines go, or None for an unseeded board
+        """
+        if d <= 0:
+            raise ValueError(str(d) + ' is an invalid dimension')
+        if n < 0 or n >= d * d:
+            raise ValueError(str(n) + ' is an invalid number of mines')
+        self.d = d
+        self.n = n
+        self.permutation = FeistelPermutation(d * d, seed)
+        # Flattened index to cell value, for every cell that is no longer hidden
+        self.cells = {}
+        # Whether each cell looked at so far is a mine, as every cell gets asked about by all of its neighbors
+        self.known_mines = {}
+        self.num_hidden = d * d
+
+    def __len__(self):
+        return self.d
+
+    def is_mine(self, index):
+        """
+        :param index: flattened cell index
+        :return: True if the cell is a mine
+        """
+        mine = self.known_mines.get(index)
+        if mine is None:
+            mine = self.known_mines[index] = self.permutation.forward(index) < self.n
+        return mine
+
+    def mine_indices(self):
+        """
+        :return: generator of the flattened index of every mine, n steps rather than d * d
+        """
+        return (self.permutation.inverse(rank) for rank in range(self.n))
+
+    def neighbor_indices(self, index):
+        """
+        :param index: flattened cell index
+        :return: list of neighbor indices
+        """
+        d = self.d
+        i, j = divmod(index, d)
+        if 0 < i < d - 1 and 0 < j < d - 1:
+            return [index - d - 1, index - d, index - d + 1, index - 1, index + 1, index + d - 1, index + d,
+                    index + d + 1]
+        return [ni * d + nj for ni in range(max(i - 1, 0), min(i + 2, d)) for nj in range(max(j - 1, 0), min(j + 2, d))
+                if ni != i or nj != j]
+
+    def clue(self, index):
+        """
+        :param index: flattened cell index
+        :return: number of mines around the cell
+        """
+        return sum(self.is_mine(neighbor) for neighbor in self.neighbor_indices(index))
+
+    def cell(self, index):
+        """
+        :param index: flattened cell index
+        :return: what the cell shows, HIDDEN if it hasn't been revealed or flagged
+        """
+        return self.cells.get(index, HIDDEN)
+
+    def reveal(self, index):
+        """
+        Uncovers a hidden cell.
+
+        :param index: flattened cell index
+        :return: the cell's clue, or EXPLODED if it was a mine
+        """
+        value = EXPLODED if self.is_mine(index) else self.clue(index)
+        self.cells[index] = value
+        self.num_hidden -= 1
+        return value
+
+    def flag(self, index):
+        """
+        Marks a hidden cell as mined.
+
+        :param index: flattened cell index
+        :return: nothing
+        """
+        self.cells[index] = FLAGGED
+        self.num_hidden -= 1
+
+    def pick_hidden(self, rng=None):
+        """
+        Picks a hidden cell uniformly at random, by drawing cells until one is hidden. Once most cells are uncovered
+        that gets slow, so the hidden cells are listed instead.
+
+        :param rng: random.Random to draw from, or None to use the random module
+        :return: flattened cell index
+        """
+        rng = rng or random
+        size = self.d * self.d
+        for _ in range(64):
+            index = rng.randrange(0, size)
+            if index not in self.cells:
+                return index
+        return rng.choice([index for index in range(size) if index not in self.cells])
+
+    def to_board(self):
+        """
+        Builds the same board in the array form the other agents play on, only sensible for small boards.
+
+        :return: completely covered Board, set of mine coordinates
+        """
+        mines = set(divmod(index, self.d) for index in self.mine_indices())
+        return Board(self.d, mines), mines
+
+
+class LazyBasicAgent:
+    def __init__(self, board, rng=None):
+        """
+        The basic agent's strategy for a LazyBoard. Each clue's neighbors are counted when the clue is checked instead
+        of being kept in arrays, so nothing the size of the board is ever made.
+
+        :param board: LazyBoard to play
+        :param rng: random.Random used for every guess, or None to use the random module
+        """
+        self.board = board
+        self.rng = rng
+        # Clue cells whose neighborhood changed since they were last checked
+        self.dirty = deque()
+        self.num_flagged = 0
+        self.num_correctly_flagged = 0
+        self.num_guesses = 0
+        self.score = 0
+
+    def reveal(self, index):
+        """
+        Uncovers a hidden cell and queues the clues that changed.
+
+        :param index: flattened cell index
+        :return: nothing
+        """
+        board = self.board
+        if board.reveal(index) <= 8:
+            self.dirty.append(index)
+        self.dirty.extend(neighbor for neighbor in board.neighbor_indices(index) if board.cell(neighbor) <= 8)
+
+    def flag(self, index):
+        """
+        Flags a hidden cell and queues the clues that changed.
+
+        :param index: flattened cell index
+        :return: nothing
+        """
+        board = self.board
+        board.flag(index)
+        self.num_flagged += 1
+        self.num_correctly_flagged += board.is_mine(index)
+        self.dirty.extend(neighbor for neighbor in board.neighbor_indices(index) if board.cell(neighbor) <= 8)
+
+    def infer(self, stop=0):
+        """
+        Use individual cell inference to mark hidden cells as safe or mined, until no clue is left to check.
+
+        :param stop: also stop once only this many cells are hidden
+        :return: nothing
+        """
+        board = self.board
+        cells = board.cells
+        while self.dirty and board.num_hidden > stop:
+            index = self.dirty.popleft()
+            neighbors = board.neighbor_indices(index)
+            hidden, num_flagged, num_exploded = [], 0, 0
+            for neighbor in neighbors:
+                cell = cells.get(neighbor, HIDDEN)
+                if cell == HIDDEN:
+                    hidden.append(neighbor)
+                elif cell == FLAGGED:
+                    num_flagged += 1
+                elif cell == EXPLODED:
+                    num_exploded += 1
+            if not hidden:
+                continue
+            rule = basic_rule(cells[index], len(neighbors), len(neighbors) - len(hidden) - num_flagged - num_exploded,
+                              num_flagged + num_exploded, len(hidden) + num_flagged)
+            if rule == FLAGGED:
+                # every hidden neighbor is a mine
+                for neighbor in hidden:
+                    if neighbor not in cells:
+                        self.flag(neighbor)
+            elif rule == CLEAR:
+                # every hidden neighbor is safe
+                for neighbor in hidden:
+                    if neighbor not in cells:
+                        self.reveal(neighbor)
+
+    def run(self, max_moves=None):
+        """
+        Plays until the board is done, or until max_moves cells have been revealed or flagged.
+
+        :param max_moves: how many cells to uncover before stopping, or None to finish the game
+        :return: nothing
+        """
+        board = self.board
+        stop = 0 if max_moves is None else max(board.num_hidden - max_moves, 0)
+        while board.num_hidden > stop:
+            self.infer(stop)
+            if board.num_hidden > stop:
+                # reveal random cell and update info
+                self.num_guesses += 1
+                self.reveal(board.pick_hidden(self.rng))
+        self.score = 1 if board.n == 0 else self.num_correctly_flagged / board.n
+
+
+def check_lazy_board(d, n, seed=0):
+    """
+    Checks a small LazyBoard against the array board it stands for: the mines found one cell at a time have to be
+    the n listed through the inverse shuffle, and every clue has to match. The lazy agent then has to finish the game
+    and never flag a safe cell.
+
+    :param d: dimension of board
+    :param n: number of mines
+    :param seed: seed for the board and the guesses
+    :return: True if everything matches
+    """
+    lazy = LazyBoard(d, n, seed)
+    board, mines = lazy.to_board()
+    if len(mines) != n or any(lazy.is_mine(index) != (divmod(index, d) in mines) for index in range(d * d)):
+        return False
+    if any(lazy.clue(index) != board.clues[divmod(index, d)] for index in range(d * d)):
+        return False
+    agent = LazyBasicAgent(lazy, random.Random(seed))
+    agent.run()
+    return lazy.num_hidden == 0 and agent.num_flagged == agent.num_correctly_flagged
+
+
+if __name__ == "__main__":
+    print('checks', all(check_lazy_board(d, round(d * d * density), seed)
+                        for d in [1, 2, 5, 16, 33] for density in [0, 0.1, 0.2, 0.4] for seed in range(3)
+                        if round(d * d * density) < d * d))
+    # A 10,000 x 10,000 board at 0.1% density, played for 250,000 moves. Making the board takes no time at all
+    start = time.perf_counter()
+    lazy = LazyBoard(10000, 100000, seed=0)
+    agent = LazyBasicAgent(lazy, random.Random(0))
+    agent.run(max_moves=250000)
+    print('%d cells uncovered, %d flagged, %d guesses in %.1f s' % (
+        10000 * 10000 - lazy.num_hidden, agent.num_flagged, agent.num_guesses, time.perf_counter() - start))
@@ -0,0 +1,89 @@
+from fractions import Fraction
+from math import gcd, lcm
+
+# Every backend takes the rows of one group of equations as (coefficients, right hand side) pairs, with coefficients
+# a dictionary from column to its nonzero value, and the columns in the order to pick pivots. It returns the nonzero
+# rows of the reduced row echelon form in the same format, in pivot order. The reduced row echelon form of a matrix is
+# unique, so every exact backend gives the same rows.
+
+
+def integer_rref(rows, columns):
+    """
+    Reduces rows with exact integer arithmetic, no sympy needed. Rows are kept sparse, and are scaled to whole
+    numbers and divided by the gcd of their entries after every step, so nothing grows beyond what the matrix needs.
+    Only the finished pivot rows are divided by their pivot, which is where fractions can appear.
+
+    :param rows: list of (coefficients, right hand side) pairs, values are ints or Fractions
+    :param columns: the columns of the rows, in the order to pick pivots
+    :return: list of reduced (coefficients, right hand side) pairs, values are ints or Fractions
+    """
+    # Scale every row to whole numbers, the right hand side is stored under None
+    remaining = []
+    for coefs, rhs in rows:
+        row = dict(coefs)
+        row[None] = rhs
+        scale = lcm(*(Fraction(value).denominator for value in row.values()))
+        remaining.append({key: int(value * scale) for key, value in row.items() if value != 0})
+
+    pivots, pivot_columns = [], []
+    for column in columns:
+        pivot = next((row for row in remaining if column in row), None)
+        if pivot is None:
+            continue
+        remaining = [row for row in remaining if row is not pivot]
+        p = pivot[column]
+        # Clear the column from every other row, keeping them whole and as small as possible
+        for others in (remaining, pivots):
+            for k, row in enumerate(others):
+                a = row.get(column)
+                if a is None:
+                    continue
+                g = gcd(a, p)
+                pa, ap = p // g, a // g
+                new = {key: value * pa for key, value in row.items()}
+                for key, value in pivot.items():
+                    value = new.get(key, 0) - value * ap
+                    if value == 0:
+                        new.pop(key, None)
+                    else:
+                        new[key] = value
+                divisor = gcd(*new.values())
+                others[k] = {key: value // divisor for key, value in new.items()} if divisor > 1 else new
+        pivots.append(pivot)
+        pivot_columns.append(column)
+
+    reduced = []
+    for column, row in zip(pivot_columns, pivots):
+        p = row[column]
+        rhs = row.pop(None, 0)
+        # Coefficients are listed in column order like a row read off a dense matrix, so deductions come out in the
+        # same order whichever backend made the row
+        coefs = {key: row[key] // p if row[key] % p == 0 else Fraction(row[key], p) for key in columns if key in row}
+        reduced.append((coefs, rhs // p if rhs % p == 0 else Fraction(rhs, p)))
+    return reduced
+
+
+def sympy_rref(rows, columns):
+    """
+    Reduces rows with sympy, kept as a reference for the other backends. Sympy is only imported the first time this
+    is used, so processes that never use it don't pay for importing it.
+
+    :param rows: list of (coefficients, right hand side) pairs
+    :param columns: the columns of the rows, in the order to pick pivots
+    :return: list of reduced (coefficients, right hand side) pairs, values are sympy numbers
+    """
+    import sympy
+    dense_mat = [[coefs.get(index, 0) for index in columns] + [rhs] for coefs, rhs in rows]
+    reduced = []
+    for row in sympy.Matrix(dense_mat).rref()[0].tolist():
+        coefs = {columns[i]: e for i, e in enumerate(row[:-1]) if e != 0}
+        if len(coefs) != 0:
+            reduced.append((coefs, row[-1]))
+    return reduced
+
+
+BACKENDS = {
+    'integer': integer_rref,
+    'sympy': sympy_rref,
+}
+DEFAULT_BACKEND = 'integer'
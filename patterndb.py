@@ -0,0 +1,263 @@
+import argparse
+import json
+import random
+import numpy as np
+from functools import lru_cache
+from util import *
+
+MAGIC = b'MINEPDB1'
+DEFAULT_PATH = 'patterns.db'
+# Tables are built for clue pairs at these offsets, every other pair that shares cells is one of them turned around
+OFFSETS = [(0, 1), (1, 1), (0, 2), (1, 2), (2, 2)]
+# How each pair a clue can make with a clue after it in board order maps onto a table: (table, transposed, mirrored)
+ORIENTATIONS = {(0, 1): (0, False, False), (1, 0): (0, True, False),
+                (1, 1): (1, False, False), (1, -1): (1, False, True),
+                (0, 2): (2, False, False), (2, 0): (2, True, False),
+                (1, 2): (3, False, False), (1, -2): (3, False, True),
+                (2, 1): (3, True, False), (2, -1): (3, True, True),
+                (2, 2): (4, False, False), (2, -2): (4, False, True)}
+
+
+def window_cells(offset):
+    """
+    The cells around a clue at (0, 0) and a clue at offset, which are the only cells either clue says anything about.
+
+    :param offset: di, dj of the second clue
+    :return: sorted list of (di, dj) of every cell next to either clue, apart from the clues themselves
+    """
+    cells = set()
+    for ci, cj in [(0, 0), offset]:
+        for di in [-1, 0, 1]:
+            for dj in [-1, 0, 1]:
+                cells.add((ci + di, cj + dj))
+    cells.discard((0, 0))
+    cells.discard(offset)
+    return sorted(cells)
+
+
+def build_table(offset):
+    """
+    Works out what two clues force for every way the cells around them can be hidden. Entry (mask * 9 + a) * 9 + b
+    is for the hidden cells in mask, with a mines left around the first clue and b around the second.
+
+    Say S is the hidden cells next to both clues and A and B the ones next to only the first or only the second. The
+    clues only limit how many of the s mines in S there are: at least a - |A| and b - |B|, at most |S|, a and b, and
+    for each s that fits, any s cells of S, a - s of A and b - s of B can be mines. So a cell is forced exactly when
+    only one s fits and that s leaves its part all mines or all safe.
+
+    :param offset: di, dj of the second clue
+    :return: uint32 array, the low 16 bits are the window cells forced to be mines and the high 16 bits the safe ones
+    """
+    cells = window_cells(offset)
+    m = len(cells)
+    near_first = sum(1 << k for k, (i, j) in enumerate(cells) if abs(i) <= 1 and abs(j) <= 1)
+    near_second = sum(1 << k for k, (i, j) in enumerate(cells) if abs(i - offset[0]) <= 1 and abs(j - offset[1]) <= 1)
+
+    masks = np.arange(1 << m, dtype=np.int64)
+    popcount = np.array([bin(mask).count('1') for mask in range(1 << m)], dtype=np.int64)
+    both = masks & near_first & near_second
+    only_first = masks & near_first & ~near_second
+    only_second = masks & near_second & ~near_first
+    size_both, size_first, size_second = popcount[both], popcount[only_first], popcount[only_second]
+
+    a = np.arange(9).reshape(1, 9, 1)
+    b = np.arange(9).reshape(1, 1, 9)
+    size_both, size_first, size_second = size_both[:, None, None], size_first[:, None, None], size_second[:, None, None]
+    low = np.maximum(np.maximum(a - size_first, b - size_second), 0)
+    high = np.minimum(np.minimum(size_both, a), b)
+    # Only one number of mines fits in S
+    pinned = (low == high) & (a <= size_both + size_first) & (b <= size_both + size_second)
+    s = low
+
+    def forced(part, size, count):
+        mines = np.where(pinned & (count == size), part[:, None, None], 0)
+        safe = np.where(pinned & (count == 0), part[:, None, None], 0)
+        return mines, safe
+
+    mines, safe = np.zeros(pinned.shape, dtype=np.int64), np.zeros(pinned.shape, dtype=np.int64)
+    for part, size, count in [(both, size_both, s), (only_first, size_first, a - s), (only_second, size_second, b - s)]:
+        part_mines, part_safe = forced(part, size, count)
+        mines |= part_mines
+        safe |= part_safe
+    return (mines | (safe << 16)).astype(np.uint32).reshape(-1)
+
+
+def build(path=DEFAULT_PATH):
+    """
+    Builds every table and writes them to one file: the magic bytes, the length of a JSON header, the header, then
+    the tables as little endian uint32 arrays, each starting on a 64 byte boundary.
+
+    :param path: file to write
+    :return: nothing
+    """
+    tables = [build_table(offset) for offset in OFFSETS]
+    header = {'offsets': OFFSETS, 'tables': []}
+    position = 0
+    for offset, table in zip(OFFSETS, tables):
+        header['tables'].append({'offset': list(offset), 'cells': window_cells(offset), 'start': position,
+                                 'entries': len(table)})
+        position += (table.nbytes + 63) // 64 * 64
+    header_bytes = json.dumps(header).encode()
+    data_start = (len(MAGIC) + 4 + len(header_bytes) + 63) // 64 * 64
+    with open(path, 'wb') as f:
+        f.write(MAGIC + len(header_bytes).to_bytes(4, 'little') + header_bytes)
+        for info, table in zip(header['tables'], tables):
+            f.seek(data_start + info['start'])
+            f.write(table.astype('<u4').tobytes())
+
+
+class PatternDatabase:
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        The tables written by build, memory mapped rather than read, so every process that opens the same file shares
+        one copy through the page cache.
+
+        :param path: file written by build
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(path + ' is not a pattern database')
+            header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+            data_start = (f.tell() + 63) // 64 * 64
+        self.tables = []
+        self.cells = []
+        for info in header['tables']:
+            self.tables.append(np.memmap(path, dtype='<u4', mode='r', offset=data_start + info['start'],
+                                         shape=(info['entries'],)))
+            self.cells.append([tuple(cell) for cell in info['cells']])
+        # For each way two clues can sit, the table and each window cell turned to match the board
+        self.windows = {}
+        for offset, (table, transposed, mirrored) in ORIENTATIONS.items():
+            cells = self.cells[table]
+            if transposed:
+                cells = [(j, i) for i, j in cells]
+            if mirrored:
+                cells = [(i, -j) for i, j in cells]
+            self.windows[offset] = (self.tables[table], cells)
+        self.lookups = 0
+
+    def lookup(self, dim, first, first_clue, second, second_clue):
+        """
+        Everything two clues force, in one table read.
+
+        :param dim: board dimension
+        :param first: i, j of the clue that comes first in board order
+        :param first_clue: its ClueSolver.Clue
+        :param second: i, j of the other clue, which has to be one of the offsets in ORIENTATIONS away
+        :param second_clue: its ClueSolver.Clue
+        :return: bitsets over the board of the cells forced to be mines and forced to be safe
+        """
+        table, cells = self.windows[(second[0] - first[0], second[1] - first[1])]
+        hidden = first_clue.hidden | second_clue.hidden
+        i, j = first
+        indices = []
+        mask = 0
+        for k, (di, dj) in enumerate(cells):
+            ni, nj = i + di, j + dj
+            if 0 <= ni < dim and 0 <= nj < dim:
+                index = ni * dim + nj
+                indices.append(index)
+                if hidden >> index & 1:
+                    mask |= 1 << k
+            else:
+                indices.append(-1)
+        self.lookups += 1
+        entry = int(table[(mask * 9 + first_clue.num_mines) * 9 + second_clue.num_mines])
+        mines = safe = 0
+        for k, index in enumerate(indices):
+            if entry >> k & 1:
+                mines |= 1 << index
+            if entry >> (k + 16) & 1:
+                safe |= 1 << index
+        return mines, safe
+
+
+@lru_cache(maxsize=4)
+def load(path=DEFAULT_PATH):
+    """
+    Opens a pattern database once per process.
+
+    :param path: file written by build
+    :return: PatternDatabase
+    """
+    return PatternDatabase(path)
+
+
+def verify(db, samples=2000, seed=0):
+    """
+    Checks random entries of every table. Each has to match working out the forced cells by trying every way to place
+    mines in the hidden cells, and has to contain everything solve_improved deduces from the same two clues.
+
+    :param db: PatternDatabase to check
+    :param samples: entries to check per table
+    :param seed: seed for picking entries
+    :return: list of (offset, mask, a, b, what differed) for every entry that is wrong
+    """
+    rng = random.Random(seed)
+    problems = []
+    d = 8
+    first = (3, 3)
+    for offset in OFFSETS:
+        table, cells = db.windows[offset]
+        second = (first[0] + offset[0], first[1] + offset[1])
+        near_first = [k for k, (i, j) in enumerate(cells) if abs(i) <= 1 and abs(j) <= 1]
+        near_second = [k for k, (i, j) in enumerate(cells) if abs(i - offset[0]) <= 1 and abs(j - offset[1]) <= 1]
+        checked = 0
+        while checked < samples:
+            mask = rng.randrange(1 << len(cells))
+            hidden = [k for k in range(len(cells)) if mask >> k & 1]
+            first_hidden = [k for k in near_first if mask >> k & 1]
+            second_hidden = [k for k in near_second if mask >> k & 1]
+            if not first_hidden or not second_hidden:
+                continue
+            a, b = rng.randint(0, len(first_hidden)), rng.randint(0, len(second_hidden))
+            checked += 1
+
+            # Every placement of mines that fits both clues
+            fits = [placement for placement in range(1 << len(hidden))
+                    if sum(placement >> t & 1 for t, k in enumerate(hidden) if k in first_hidden) == a
+                    and sum(placement >> t & 1 for t, k in enumerate(hidden) if k in second_hidden) == b]
+            expected_mines = expected_safe = 0
+            if fits:
+                for t, k in enumerate(hidden):
+                    values = set(placement >> t & 1 for placement in fits)
+                    if values == {1}:
+                        expected_mines |= 1 << k
+                    elif values == {0}:
+                        expected_safe |= 1 << k
+            entry = int(table[(mask * 9 + a) * 9 + b])
+            if (entry & 0xffff, entry >> 16) != (expected_mines, expected_safe):
+                problems.append((offset, mask, a, b, 'does not match every placement'))
+                continue
+
+            if fits:
+                # Whatever the matrix finds has to be in the table too
+                to_cell = {k: (first[0] + cells[k][0], first[1] + cells[k][1]) for k in hidden}
+                solver = ClueSolver(d, (-1, False))
+                solver.add_clue(a, set(to_cell[k] for k in first_hidden), 0, first)
+                solver.add_clue(b, set(to_cell[k] for k in second_hidden), 0, second)
+                solution, _ = solver.solve_improved()
+                mine_cells, safe_cells = solution.mine_cells(), solution.safe_cells()
+                found_mines = sum(1 << k for k in hidden if to_cell[k] in mine_cells)
+                found_safe = sum(1 << k for k in hidden if to_cell[k] in safe_cells)
+                if found_mines & ~expected_mines or found_safe & ~expected_safe:
+                    problems.append((offset, mask, a, b, 'misses a deduction solve_improved makes'))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Builds and checks the table of what pairs of clues force')
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--path', default=DEFAULT_PATH, help='database file')
+    parser.add_argument('--samples', type=int, default=2000, help='entries to check per table')
+    parser.add_argument('--seed', type=int, default=0, help='seed for picking entries to check')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.path)
+        print('wrote ' + args.path)
+    else:
+        problems = verify(PatternDatabase(args.path), args.samples, args.seed)
+        for problem in problems:
+            print(problem)
+        print('%d problems' % len(problems))
+        raise SystemExit(1 if problems else 0)
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import deque
+from util import *
+from benchmark import percentile
+
+
+class GameServer:
+    def __init__(self):
+        """
+        Keeps any number of games going at once and answers requests about them, so agents only ever see what a player
+        would: the clues of the cells they uncover. Requests are dictionaries with an 'op' and answers are dictionaries
+        too, or {'error': message} when a request can't be carried out.
+
+        new: {'d', 'n', optional 'seed', optional 'cascade'} -> {'game'}
+        query: {'game', 'cell'} -> {'cells': [[index, value], ...]} for every cell uncovered, more than one if the
+            game cascades
+        flag: {'game', 'cell'} -> {}
+        score: {'game'} -> {'score', 'done'}
+        close: {'game'} -> {}
+
+        Cells are flattened indices i * d + j. Requests wait in a queue and everything that arrived during one tick of
+        the event loop is handled together, so thousands of games share one wakeup instead of one each.
+        """
+        self.games = {}
+        self.game_ids = itertools.count()
+        self.pending = []
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def submit(self, request):
+        """
+        Queues a request to be handled on the next tick.
+
+        :param request: request dictionary
+        :return: future for the answer
+        """
+        future = asyncio.get_running_loop().create_future()
+        if not self.pending:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self.pending.append((request, future))
+        return future
+
+    def flush(self):
+        """
+        Handles every queued request, in the order they arrived.
+
+        :return: nothing
+        """
+        batch, self.pending = self.pending, []
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        for request, future in batch:
+            try:
+                answer = self.handle(request)
+            except Exception as e:
+                # A bad request only gets an error, it never stops the rest of the batch from being answered
+                answer = {'error': str(e) or type(e).__name__}
+            if isinstance(request, dict) and 'id' in request:
+                answer['id'] = request['id']
+            if not future.cancelled():
+                future.set_result(answer)
+
+    def handle(self, request):
+        """
+        :param request: request dictionary
+        :return: answer dictionary
+        """
+        if not isinstance(request, dict):
+            raise TypeError('request must be a JSON object')
+        op = request['op']
+        if op == 'new':
+            d, n = int(request['d']), int(request['n'])
+            if d <= 0 or n < 0 or n >= d * d:
+                raise ValueError('invalid board size %d with %d mines' % (d, n))
+            board, mines = generate_board(d, n, random.Random(request.get('seed')))
+            game = next(self.game_ids)
+            self.games[game] = (board, mines, bool(request.get('cascade', False)))
+            return {'game': game}
+        if request['game'] not in self.games:
+            raise KeyError('no game %s' % request['game'])
+        board, mines, cascade = self.games[request['game']]
+        if op == 'score':
+            return {'score': get_score(board, mines), 'done': completed(board)}
+        if op == 'close':
+            del self.games[request['game']]
+            return {}
+
+        d = len(board)
+        index = int(request['cell'])
+        if not 0 <= index < d * d:
+            raise ValueError('cell %d is off the board' % index)
+        if board.cells.reshape(-1)[index] != HIDDEN:
+            raise ValueError('cell %d is not hidden' % index)
+        if op == 'query':
+            revealed = []
+            query(divmod(index, d), board, mines, revealed if cascade else None)
+            cells = board.cells.reshape(-1)
+            return {'cells': [[k, int(cells[k])] for k in (revealed if cascade else [index])]}
+        if op == 'flag':
+            flag(divmod(index, d), board)
+            return {}
+        raise ValueError('unknown op %s' % op)
+
+    async def serve(self, reader, writer):
+        """
+        Answers the requests of one socket connection, one JSON object per line each way. Requests can be sent without
+        waiting for answers, and answers come back in the same order.
+
+        :param reader: asyncio.StreamReader of the connection
+        :param writer: asyncio.StreamWriter of the connection
+        :return: nothing
+        """
+        def send(future):
+            if not writer.is_closing():
+                writer.write((json.dumps(future.result()) + '\n').encode())
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"error": "bad json"}\n')
+                    continue
+                self.submit(request).add_done_callback(send)
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+class LocalChannel:
+    def __init__(self, server):
+        """
+        Talks to a GameServer in the same process.
+
+        :param server: GameServer to talk to
+        """
+        self.server = server
+
+    async def request(self, **request):
+        return await self.server.submit(request)
+
+    async def close(self):
+        pass
+
+
+class SocketChannel:
+    def __init__(self, reader, writer):
+        """
+        Talks to a GameServer over a socket. Requests from any number of tasks can be in flight at once, and each
+        answer is matched to its request by id.
+
+        :param reader: asyncio.StreamReader of the connection
+        :param writer: asyncio.StreamWriter of the connection
+        """
+        self.reader = reader
+        self.writer = writer
+        self.waiting = {}
+        self.ids = itertools.count()
+        self.receiver = asyncio.get_running_loop().create_task(self.receive())
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def receive(self):
+        try:
+            while line := await self.reader.readline():
+                answer = json.loads(line)
+                future = self.waiting.pop(answer.pop('id', None), None)
+                if future is not None and not future.cancelled():
+                    future.set_result(answer)
+        finally:
+            # The server is gone, so nothing still waiting will ever get an answer
+            waiting, self.waiting = self.waiting, {}
+            for future in waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('connection closed before the server answered'))
+
+    async def request(self, **request):
+        if self.receiver.done():
+            raise ConnectionError('connection closed')
+        request['id'] = next(self.ids)
+        future = self.waiting[request['id']] = asyncio.get_running_loop().create_future()
+        self.writer.write((json.dumps(request) + '\n').encode())
+        return await future
+
+    async def close(self):
+        self.receiver.cancel()
+        self.writer.close()
+
+
+async def play_remote(channel, d, n, seed=None, cascade=True, latencies=None):
+    """
+    Plays one game through a channel with the basic agent's strategy, knowing only what the server answers.
+
+    :param channel: LocalChannel or SocketChannel
+    :param d: board dimension
+    :param n: number of mines
+    :param seed: seed for the board and the guesses, or None for an unseeded game
+    :param cascade: ask the server to open regions of 0s
+    :param latencies: optional list, filled with the seconds each request took
+    :return: the game's score
+    """
+    async def request(**r):
+        start = time.perf_counter()
+        answer = await channel.request(**r)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - start)
+        if 'error' in answer:
+            raise RuntimeError(answer['error'])
+        return answer
+
+    # The server draws the board from seed, guessing from the same stream would find the mines
+    rng = random.Random(None if seed is None else 'guesses %d' % seed)
+    game = (await request(op='new', d=d, n=n, seed=seed, cascade=cascade))['game']
+    table = neighbor_table(d)
+    cells = [HIDDEN] * (d * d)
+    hidden = HiddenCells(d * d)
+    dirty = deque()
+
+    def uncovered(index, value):
+        cells[index] = value
+        hidden.remove(index)
+        if value <= 8:
+            dirty.append(index)
+        dirty.extend(neighbor for neighbor in table.neighbor_indices(index) if cells[neighbor] <= 8)
+
+    async def reveal(index):
+        for k, value in (await request(op='query', game=game, cell=index))['cells']:
+            uncovered(k, value)
+
+    while len(hidden) > 0:
+        while dirty:
+            index = dirty.popleft()
+            around = [cells[k] for k in table.neighbor_indices(index)]
+            neighbors = [k for k in table.neighbor_indices(index) if cells[k] == HIDDEN]
+            if not neighbors:
+                continue
+            num_flagged, num_exploded = around.count(FLAGGED), around.count(EXPLODED)
+            rule = basic_rule(cells[index], len(around), len(around) - len(neighbors) - num_flagged - num_exploded,
+                              num_flagged + num_exploded, len(neighbors) + num_flagged)
+            if rule == FLAGGED:
+                # every hidden neighbor is a mine
+                for k in neighbors:
+                    await request(op='flag', game=game, cell=k)
+                    uncovered(k, FLAGGED)
+            elif rule == CLEAR:
+                # every hidden neighbor is safe
+                for k in neighbors:
+                    if cells[k] == HIDDEN:
+                        await reveal(k)
+        if len(hidden) > 0:
+            await reveal(hidden.pick(rng))
+
+    score = (await request(op='score', game=game))['score']
+    await request(op='close', game=game)
+    return score
+
+
+async def load_test(num_games, d, n, concurrency, channel, seed=0):
+    """
+    Plays num_games games with at most concurrency of them going at once.
+
+    :param num_games: number of games
+    :param d: board dimension
+    :param n: number of mines
+    :param concurrency: most games in flight at once
+    :param channel: LocalChannel or SocketChannel
+    :param seed: game k uses seed + k
+    :return: dictionary of games and requests per second, request latency percentiles in milliseconds and mean score
+    """
+    latencies, scores = [], []
+    games = iter(range(num_games))
+
+    async def worker():
+        for k in games:
+            scores.append(await play_remote(channel, d, n, seed + k, latencies=latencies))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'games_per_sec': num_games / elapsed,
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_score': sum(scores) / len(scores),
+    }
+
+
+async def main(args):
+    if args.command == 'serve':
+        server = await asyncio.start_server(GameServer().serve, args.host, args.port)
+        async with server:
+            await server.serve_forever()
+
+    if args.connect:
+        channel = await SocketChannel.connect(args.host, args.port)
+    else:
+        game_server = GameServer()
+        channel = LocalChannel(game_server)
+    result = await load_test(args.games, args.dim, round(args.dim * args.dim * args.density), args.concurrency,
+                             channel, args.seed)
+    await channel.close()
+    if not args.connect:
+        result['requests_per_batch'] = game_server.num_requests / game_server.num_batches
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Minesweeper game server and load test client')
+    parser.add_argument('command', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--connect', action='store_true', help='load test a server over the socket instead of '
+                                                               'one in this process')
+    parser.add_argument('--games', type=int, default=1000, help='games to play')
+    parser.add_argument('--concurrency', type=int, default=1000, help='most games in flight at once')
+    parser.add_argument('--dim', type=int, default=16, help='board dimension')
+    parser.add_argument('--density', type=float, default=0.15, help='mine density')
+    parser.add_argument('--seed', type=int, default=0, help='game k uses seed + k')
+    asyncio.run(main(parser.parse_args()))
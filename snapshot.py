@@ -0,0 +1,194 @@
+import argparse
+import json
+import random
+import struct
+import time
+from util import *
+from linalg import BACKENDS
+from benchmark import summarize
+
+MAGIC = b'MINESNP1'
+# Record length, then dimension, flags, mines left (-1 if not known) and number of clues
+RECORD = struct.Struct('<IHBiI')
+# Key cell (-1 if the clue didn't come from a cell), mines left around it and number of hidden cells
+CLUE = struct.Struct('<iHH')
+SELECTION = 1
+
+
+class SnapshotWriter:
+    def __init__(self, path, min_clues=0):
+        """
+        Writes the clues an ImprovedAgent hands its solver on every call to infer to a binary file, so the positions
+        of real games can be solved again later without playing them. The file is MAGIC followed by one record per
+        position: a RECORD header, the hidden cells of the whole board as a little endian bitset if the number of mines
+        left is known, then each clue as a CLUE header followed by its hidden cells as uint32 flattened indices.
+
+        :param path: file to write, replaced if it exists
+        :param min_clues: only keep positions with at least this many clues, to keep just the hard ones
+        """
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.min_clues = min_clues
+        self.num_written = 0
+
+    def record(self, solver):
+        """
+        :param solver: the ClueSolver about to be asked to solve
+        :return: nothing
+        """
+        if len(solver.clues) < self.min_clues:
+            return
+        d = solver.dim
+        parts = []
+        if solver.global_mines is not None:
+            parts.append(solver.global_hidden.to_bytes((d * d + 7) // 8, 'little'))
+        for key, clue in solver.clues.items():
+            indices = list(bit_indices(clue.hidden))
+            parts.append(CLUE.pack(key[0] * d + key[1] if isinstance(key, tuple) else -1, clue.num_mines,
+                                   len(indices)))
+            parts.append(struct.pack('<%dI' % len(indices), *indices))
+        body = b''.join(parts)
+        global_mines = -1 if solver.global_mines is None else solver.global_mines
+        self.file.write(RECORD.pack(RECORD.size + len(body), d, SELECTION if solver.selection else 0, global_mines,
+                                    len(solver.clues)) + body)
+        self.num_written += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_snapshots(path):
+    """
+    Streams the positions in a file written by SnapshotWriter, one at a time.
+
+    :param path: snapshot file
+    :return: generator of dictionaries with the board dimension, whether to use the optimized selection, the number
+        of mines left (None if not known), the hidden cells as a bitset (0 if not known) and the clues as
+        (key, mines left, hidden cells bitset) triples
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a snapshot file')
+        while header := f.read(RECORD.size):
+            length, d, flags, global_mines, num_clues = RECORD.unpack(header)
+            body = f.read(length - RECORD.size)
+            offset = 0
+            global_hidden = 0
+            if global_mines != -1:
+                size = (d * d + 7) // 8
+                global_hidden = int.from_bytes(body[:size], 'little')
+                offset = size
+            clues = []
+            for _ in range(num_clues):
+                key, num_mines, count = CLUE.unpack_from(body, offset)
+                offset += CLUE.size
+                hidden = 0
+                for index in struct.unpack_from('<%dI' % count, body, offset):
+                    hidden |= 1 << index
+                offset += 4 * count
+                clues.append((divmod(key, d) if key != -1 else None, num_mines, hidden))
+            yield {'dim': d, 'selection': bool(flags & SELECTION),
+                   'global_mines': None if global_mines == -1 else global_mines, 'global_hidden': global_hidden,
+                   'clues': clues}
+
+
+def build_solver(snapshot, backend=DEFAULT_BACKEND, **kwargs):
+    """
+    :param snapshot: position from read_snapshots
+    :param backend: name of the row reduction backend
+    :param kwargs: any other arguments of ClueSolver, such as pattern_db or max_cells
+    :return: new ClueSolver holding the position
+    """
+    solver = ClueSolver(snapshot['dim'], (-1, snapshot['selection']), backend, **kwargs)
+    for key, num_mines, hidden in snapshot['clues']:
+        solver.add_clue(num_mines, hidden, 0, key)
+    if snapshot['global_mines'] is not None:
+        solver.set_global(snapshot['global_mines'], snapshot['global_hidden'], 0)
+    return solver
+
+
+def replay(path, solvers, limit=None):
+    """
+    Solves every position in a snapshot file from scratch with each solver, timing solve_basic, solve_improved and,
+    for positions that know how many mines are left, solve_global, and checking that every solver deduces the same as
+    the first.
+
+    :param path: snapshot file
+    :param solvers: dictionary from name to a function making a ClueSolver from a position, the first is the reference
+    :param limit: most positions to replay, or None for all of them
+    :return: dictionary from solver name to the seconds taken by each position for each method, and a list of
+        (position number, solver name, method) for every deduction that differed from the reference
+    """
+    timings = {name: {'solve_basic': [], 'solve_improved': [], 'solve_global': []} for name in solvers}
+    mismatches = []
+    for k, snapshot in enumerate(read_snapshots(path)):
+        if limit is not None and k >= limit:
+            break
+        reference = {}
+        for name, make in solvers.items():
+            solver = make(snapshot)
+            for method in ['solve_basic', 'solve_improved', 'solve_global']:
+                if method == 'solve_global' and snapshot['global_mines'] is None:
+                    continue
+                start = time.perf_counter()
+                solution = getattr(solver, method)()
+                timings[name][method].append(time.perf_counter() - start)
+                if isinstance(solution, tuple):
+                    solution = solution[0]
+                deduced = (solution.mine_bits, solution.safe_bits)
+                if method not in reference:
+                    reference[method] = deduced
+                elif deduced != reference[method]:
+                    mismatches.append((k, name, method))
+    return timings, mismatches
+
+
+def record_games(path, num_games, d, n, info, seed=0, min_clues=0):
+    """
+    Plays seeded ImprovedAgent games and writes the position at every call to infer.
+
+    :param path: snapshot file to write
+    :param num_games: number of games
+    :param d: board dimension
+    :param n: number of mines
+    :param info: info argument of ImprovedAgent
+    :param seed: game k uses seed + k
+    :param min_clues: only keep positions with at least this many clues
+    :return: number of positions written
+    """
+    writer = SnapshotWriter(path, min_clues)
+    try:
+        for k in range(num_games):
+            ImprovedAgent(d, n, info, rng=random.Random(seed + k), snapshots=writer).run()
+    finally:
+        writer.close()
+    return writer.num_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Records the positions of real games and solves them again')
+    parser.add_argument('command', choices=['record', 'replay'])
+    parser.add_argument('path', help='snapshot file')
+    parser.add_argument('--games', type=int, default=20, help='games to record')
+    parser.add_argument('--dim', type=int, default=30, help='board dimension of recorded games')
+    parser.add_argument('--density', type=float, default=0.2, help='mine density of recorded games')
+    parser.add_argument('--global-info', action='store_true', help='record games that know the global mine count')
+    parser.add_argument('--seed', type=int, default=0, help='game k uses seed + k')
+    parser.add_argument('--min-clues', type=int, default=0, help='only keep positions with this many clues')
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS),
+                        help='backends to replay with, the first is the reference')
+    parser.add_argument('--limit', type=int, help='most positions to replay')
+    args = parser.parse_args()
+    if args.command == 'record':
+        n = round(args.dim * args.dim * args.density)
+        print('%d positions' % record_games(args.path, args.games, args.dim, n, (n if args.global_info else -1, False),
+                                           args.seed, args.min_clues))
+    else:
+        timings, mismatches = replay(args.path, {backend: lambda snapshot, backend=backend: build_solver(
+            snapshot, backend) for backend in args.backends}, args.limit)
+        print(json.dumps({name: {method: summarize(samples) for method, samples in methods.items() if samples}
+                          for name, methods in timings.items()}, indent=2))
+        for mismatch in mismatches:
+            print('position %d: %s differs in %s' % mismatch)
+        print('%d mismatches' % len(mismatches))
+        raise SystemExit(1 if mismatches else 0)
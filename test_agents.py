@@ -0,0 +1,98 @@
+import random
+import pytest
+from util import *
+import batch
+
+
+class BaselineBasicAgent:
+    def __init__(self, board, mines):
+        """
+        The basic agent as it was first written: every pass scans the whole board in row major order and marks cells as
+        soon as a clue's rule matches, and passes go on while they reveal anything. Kept to check that BasicAgent still
+        makes the same deductions.
+
+        :param board: minesweeper board
+        :param mines: set of mine coordinates
+        """
+        d = len(board)
+        self.board = board
+        self.mines = mines
+        self.num_safe_board = [[0 for _ in range(d)] for _ in range(d)]
+        self.num_mines_board = [[0 for _ in range(d)] for _ in range(d)]
+        self.num_hidden_board = [[len(get_neighbor_coordinates((i, j), d)) for j in range(d)] for i in range(d)]
+
+    def infer(self):
+        d = len(self.board)
+        cells = self.board.cells
+        new_clues = True
+        while new_clues and not completed(self.board):
+            new_clues = False
+            for i in range(d):
+                for j in range(d):
+                    clue = int(cells[i, j])
+                    if clue > 8:
+                        continue
+                    if clue - self.num_mines_board[i][j] == self.num_hidden_board[i][j]:
+                        for ni, nj in get_neighbor_coordinates((i, j), d):
+                            if cells[ni, nj] == HIDDEN:
+                                flag((ni, nj), self.board)
+                                for ni2, nj2 in get_neighbor_coordinates((ni, nj), d):
+                                    self.num_mines_board[ni2][nj2] += 1
+                    elif len(get_neighbor_coordinates((i, j), d)) - clue - self.num_safe_board[i][j] == \
+                            self.num_hidden_board[i][j]:
+                        for ni, nj in get_neighbor_coordinates((i, j), d):
+                            if cells[ni, nj] == HIDDEN:
+                                query((ni, nj), self.board, self.mines)
+                                new_clues = True
+                                for ni2, nj2 in get_neighbor_coordinates((ni, nj), d):
+                                    self.num_safe_board[ni2][nj2] += 1
+                                    self.num_hidden_board[ni2][nj2] -= 1
+
+    def guess(self, index):
+        d = len(self.board)
+        i, j = divmod(index, d)
+        query((i, j), self.board, self.mines)
+        for ni, nj in get_neighbor_coordinates((i, j), d):
+            if self.board.cells[i, j] == EXPLODED:
+                self.num_mines_board[ni][nj] += 1
+            else:
+                self.num_safe_board[ni][nj] += 1
+            self.num_hidden_board[ni][nj] -= 1
+
+
+@pytest.mark.parametrize('seed', range(60))
+def test_basic_agent_matches_baseline(seed):
+    rng = random.Random(seed)
+    d = rng.randint(8, 16)
+    n = round(d * d * rng.uniform(0.1, 0.3))
+    _, mines = generate_board(d, n, rng)
+    agent = BasicAgent(Board(d, mines), mines, rng)
+    baseline = BaselineBasicAgent(Board(d, mines), mines)
+    while True:
+        agent.infer()
+        baseline.infer()
+        assert np.array_equal(agent.board.cells, baseline.board.cells)
+        if completed(agent.board):
+            break
+        index = agent.board.hidden.pick(agent.rng)
+        agent.reveal(index)
+        baseline.guess(index)
+    assert get_score(agent.board, mines) == get_score(baseline.board, mines)
+
+
+@pytest.mark.parametrize('d, n', [(9, 10), (16, 13), (16, 40), (16, 64), (30, 150), (20, 120)])
+def test_play_basic_matches_basic_agent(d, n):
+    assert batch.check_against_basic_agent(40, d, n, seed=d * 1000 + n) == []
+
+
+@pytest.mark.parametrize('selection', [False, True])
+def test_pattern_cache_does_not_change_play(selection):
+    patterns = PatternCache()
+    for seed in range(12):
+        games = []
+        for cache in None, patterns:
+            agent = ImprovedAgent(16, 40, (-1, selection), rng=random.Random(seed), patterns=cache)
+            agent.run()
+            games.append(agent.board.cells)
+        assert np.array_equal(*games)
+    assert patterns.hits > 0
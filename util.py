@@ -1,5 +1,18 @@
-from random import randrange
-import sympy
+from collections import deque, OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+from heapq import heappop, heappush
+from math import comb
+import random
+import time
+import numpy as np
+from instrument import INFER_FIELDS, new_game_id
+from linalg import BACKENDS, DEFAULT_BACKEND
+
+# Board cells are small ints: 0 - 8 are revealed clues, the rest are the states below
+HIDDEN, FLAGGED, EXPLODED, CLEAR = 9, 10, 11, 12
+# How each cell value is printed, indexed by the value
+SYMBOLS = '012345678?MXC'
 
 
 def valid_coordinates(coordinates, d):
@@ -14,12 +27,136 @@ def valid_coordinates(coordinates, d):
     return 0 <= i < d and 0 <= j < d
 
 
-def generate_board(d, n):
+def neighbor_sum(grid):
+    """
+    Adds up the values of each cell's neighbors, a 3 x 3 convolution whose center weight is 0. Any leading axes are
+    treated as a batch of boards.
+
+    :param grid: array whose last two axes are a board
+    :return: int8 array of the same shape holding each cell's neighbor sum
+    """
+    grid = grid.astype(np.int8)
+    h, w = grid.shape[-2:]
+    padded = np.pad(grid, [(0, 0)] * (grid.ndim - 2) + [(1, 1), (1, 1)])
+    # The 3 x 3 box sum splits into a sum along rows followed by a sum along columns
+    rows = padded[..., :, :w] + padded[..., :, 1:w + 1] + padded[..., :, 2:]
+    return rows[..., :h, :] + rows[..., 1:h + 1, :] + rows[..., 2:, :] - grid
+
+
+def group_connected(items, get_cells):
+    """
+    Splits items into groups that share no cells. Two items are in the same group if they share a cell, directly or
+    through other items.
+
+    :param items: items to split, each covering at least one cell
+    :param get_cells: function giving the cells an item covers
+    :return: list of groups, each a list of items
+    """
+    parent = {}
+
+    def find(cell):
+        root = cell
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression keeps later lookups short
+        while parent[cell] != root:
+            parent[cell], cell = root, parent[cell]
+        return root
+
+    for item in items:
+        cells = iter(get_cells(item))
+        first = next(cells)
+        root = find(parent.setdefault(first, first))
+        for cell in cells:
+            other = find(parent.setdefault(cell, cell))
+            if other != root:
+                parent[other] = root
+
+    groups = {}
+    for item in items:
+        groups.setdefault(find(next(iter(get_cells(item)))), []).append(item)
+    return list(groups.values())
+
+
+class HiddenCells:
+    def __init__(self, size):
+        """
+        The flattened indices of every hidden cell, kept so that counting them, removing one, and picking one at random
+        are all O(1). The first self.count entries of self.cells are the hidden cells, and a removed cell's slot is
+        filled by the last of them.
+
+        :param size: number of cells on the board, all hidden to start with
+        """
+        self.cells = np.arange(size, dtype=np.int32)
+        # Where each cell sits in self.cells, -1 once it is no longer hidden
+        self.positions = np.arange(size, dtype=np.int32)
+        self.count = size
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, index):
+        return self.positions[index] != -1
+
+    def __iter__(self):
+        return iter(self.cells[:self.count].tolist())
+
+    def remove(self, index):
+        """
+        Stops tracking a cell that is no longer hidden.
+
+        :param index: flattened cell index
+        :return: nothing
+        """
+        position = self.positions[index]
+        self.count -= 1
+        last = self.cells[self.count]
+        self.cells[position] = last
+        self.positions[last] = position
+        self.positions[index] = -1
+
+    def pick(self, rng=None):
+        """
+        Picks a hidden cell uniformly at random.
+
+        :param rng: random.Random to draw from, or None to use the random module
+        :return: flattened cell index
+        """
+        return int(self.cells[(rng or random).randrange(0, self.count)])
+
+
+class Board:
+    def __init__(self, d, mines):
+        """
+        Array backed d x d minesweeper board. Every cell starts hidden, and each cell's clue is worked out up front.
+
+        :param d: dimension of board
+        :param mines: set of mine coordinates
+        """
+        self.mine_mask = np.zeros((d, d), dtype=bool)
+        if mines:
+            self.mine_mask[tuple(zip(*mines))] = True
+        self.cells = np.full((d, d), HIDDEN, dtype=np.int8)
+        self.clues = neighbor_sum(self.mine_mask)
+        self.hidden = HiddenCells(d * d)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, i):
+        return self.cells[i]
+
+    def __iter__(self):
+        return iter(self.cells)
+
+
+def generate_board(d, n, rng=None):
     """
     Generates a random d x d board containing n mines.
 
     :param d: dimension of board
     :param n: number of mines
+    :param rng: random.Random to draw from, or None to use the random module
     :return: completely covered d x d board, set of mine coordinates
     """
     if d <= 0:
@@ -29,20 +166,10 @@ def generate_board(d, n):
         print(str(n) + ' is an invalid number of mines')
         return
 
-    board = []
-    coordinates_list = []
-    for i in range(d):
-        board.append([])
-        for j in range(d):
-            board[i].append('?')
-            coordinates_list.append((i, j))
+    # sample draws from a range without listing it, so this takes time linear in n rather than d * d
+    mines = set(divmod(index, d) for index in (rng or random).sample(range(d * d), n))
 
-    mines = set()
-    for _ in range(n):
-        i, j = coordinates_list.pop(randrange(0, len(coordinates_list)))
-        mines.add((i, j))
-
-    return board, mines
+    return Board(d, mines), mines
 
 
 def print_board(board):
@@ -53,7 +180,72 @@ def print_board(board):
     :return: nothing
     """
     for row in board:
-        print(' '.join(str(cell) for cell in row))
+        print(' '.join(SYMBOLS[cell] for cell in row))
+
+
+class NeighborTable:
+    def __init__(self, d):
+        """
+        Neighbors of every cell on a d x d board, with cells flattened to i * d + j. The neighbors of cell k are
+        indices[offsets[k]:offsets[k + 1]], the same layout as a CSR sparse matrix.
+
+        :param d: board dimension
+        """
+        self.d = d
+        i, j = np.divmod(np.arange(d * d, dtype=np.int32), d)
+        neighbors = np.full((d * d, 8), -1, dtype=np.int32)
+        col = 0
+        for di in [-1, 0, 1]:
+            for dj in [-1, 0, 1]:
+                if di == 0 and dj == 0:
+                    continue
+                ni, nj = i + di, j + dj
+                valid = (0 <= ni) & (ni < d) & (0 <= nj) & (nj < d)
+                neighbors[valid, col] = ni[valid] * d + nj[valid]
+                col += 1
+        self.indices = neighbors[neighbors >= 0]
+        self.offsets = np.zeros(d * d + 1, dtype=np.int32)
+        np.cumsum(np.count_nonzero(neighbors >= 0, axis=1), out=self.offsets[1:])
+        # Python versions of each row are only built for the cells that get asked for
+        self.index_tuples = [None] * (d * d)
+        self.coordinate_sets = [None] * (d * d)
+
+    def neighbor_indices(self, index):
+        """
+        Get the flattened indices of all neighbors.
+
+        :param index: flattened cell index
+        :return: tuple of neighbor indices
+        """
+        neighbors = self.index_tuples[index]
+        if neighbors is None:
+            neighbors = tuple(self.indices[self.offsets[index]:self.offsets[index + 1]].tolist())
+            self.index_tuples[index] = neighbors
+        return neighbors
+
+    def neighbor_coordinates(self, index):
+        """
+        Get the coordinates of all neighbors.
+
+        :param index: flattened cell index
+        :return: frozenset of neighbor coordinates
+        """
+        neighbors = self.coordinate_sets[index]
+        if neighbors is None:
+            neighbors = frozenset(divmod(k, self.d) for k in self.neighbor_indices(index))
+            self.coordinate_sets[index] = neighbors
+        return neighbors
+
+
+@lru_cache(maxsize=8)
+def neighbor_table(d):
+    """
+    Get the neighbor table for a board dimension. Tables are built once and the most recently used ones are kept.
+
+    :param d: board dimension
+    :return: NeighborTable for d
+    """
+    return NeighborTable(d)
 
 
 def get_neighbor_coordinates(coordinates, d):
@@ -64,14 +256,8 @@ def get_neighbor_coordinates(coordinates, d):
     :param d: board dimension
     :return: set of neighbor coordinates
     """
-    neighbor_coordinates = set()
     i, j = coordinates
-    for di in [-1, 0, 1]:
-        for dj in [-1, 0, 1]:
-            ni, nj = i + di, j + dj
-            if (ni, nj) != (i, j) and valid_coordinates((ni, nj), d):
-                neighbor_coordinates.add((ni, nj))
-    return neighbor_coordinates
+    return neighbor_table(d).neighbor_coordinates(i * d + j)
 
 
 def get_clue(coordinates, mines, d):
@@ -88,46 +274,92 @@ def get_clue(coordinates, mines, d):
     return clue
 
 
-def query(coordinates, board, mines):
+def query(coordinates, board, mines, revealed=None):
     """
     Uncovers cell on board. If mine, show the mine. If not, show clue.
 
     :param coordinates: cell coordinates to query
     :param board: minesweeper board
     :param mines: set of mines
+    :param revealed: optional list. If given, uncovering a 0 also uncovers every hidden cell around it, and so on for
+        each 0 found that way, and the flattened index of every cell uncovered is appended to the list
     :return: new board
     """
     if not valid_coordinates(coordinates, len(board)):
         print(str(coordinates) + ' are invalid coordinates')
         return board
     i, j = coordinates
-    if board[i][j].isdigit() or board[i][j] == 'X':
+    cell = board.cells[i, j]
+    if cell <= 8 or cell == EXPLODED:
         print(str(coordinates) + ' was already queried')
         return board
-    if board[i][j] == 'M':
+    if cell == FLAGGED:
         print(str(coordinates) + ' was flagged as mined, we shouldn\'t search it')
         return board
 
-    board[i][j] = 'X' if (i, j) in mines else str(get_clue((i, j), mines, len(board)))
+    board.cells[i, j] = EXPLODED if (i, j) in mines else board.clues[i, j]
+    board.hidden.remove(i * len(board) + j)
+
+    if revealed is not None:
+        revealed.append(i * len(board) + j)
+        if board.cells[i, j] == 0:
+            cascade(i * len(board) + j, board, revealed)
 
     return board
 
 
-def random_query(board, mines):
+def cascade(index, board, revealed):
+    """
+    Opens the connected region of 0s around a revealed 0, and the clues bordering it, in one breadth first search.
+    The neighbors of a 0 can't be mines, so every cell opened is safe. Flagged cells are left alone.
+
+    :param index: flattened index of a revealed 0
+    :param board: minesweeper board
+    :param revealed: list to append the flattened index of every cell uncovered to
+    :return: nothing
+    """
+    table = neighbor_table(len(board))
+    cells, clues = board.cells.reshape(-1), board.clues.reshape(-1)
+    frontier = deque([index])
+    while frontier:
+        for neighbor in table.neighbor_indices(frontier.popleft()):
+            if cells[neighbor] == HIDDEN:
+                cells[neighbor] = clues[neighbor]
+                board.hidden.remove(neighbor)
+                revealed.append(neighbor)
+                if cells[neighbor] == 0:
+                    frontier.append(neighbor)
+
+
+def flag(coordinates, board):
+    """
+    Marks hidden cell on board as mined.
+
+    :param coordinates: cell coordinates to flag
+    :param board: minesweeper board
+    :return: new board
+    """
+    i, j = coordinates
+    if board.cells[i, j] != HIDDEN:
+        print(str(coordinates) + ' is not hidden')
+        return board
+
+    board.cells[i, j] = FLAGGED
+    board.hidden.remove(i * len(board) + j)
+
+    return board
+
+
+def random_query(board, mines, rng=None):
     """
     Randomly queries hidden cell on board.
 
     :param board: minesweeper board
     :param mines: set of mine coordinates
+    :param rng: random.Random to draw from, or None to use the random module
     :return: new board, random coordinates queried
     """
-    d = len(board)
-    hidden_coordinates_list = []
-    for i in range(d):
-        for j in range(d):
-            if board[i][j] == '?':
-                hidden_coordinates_list.append((i, j))
-    i, j = hidden_coordinates_list[randrange(0, len(hidden_coordinates_list))]
+    i, j = divmod(board.hidden.pick(rng), len(board))
     return query((i, j), board, mines), (i, j)
 
 
@@ -138,12 +370,7 @@ def completed(board):
     :param board: minesweeper board
     :return: if board has been completed
     """
-    d = len(board)
-    for row in board:
-        for cell in row:
-            if cell == '?':
-                return False
-    return True
+    return len(board.hidden) == 0
 
 
 def get_score(board, mines):
@@ -154,68 +381,142 @@ def get_score(board, mines):
     :param mines: set of mine coordinates
     :return: # correctly flagged mines / # mines
     """
-    num_correctly_flagged_mines = 0
-    for i, j in mines:
-        if board[i][j] == 'M':
-            num_correctly_flagged_mines += 1
+    num_correctly_flagged_mines = int(np.count_nonzero(board.cells[board.mine_mask] == FLAGGED))
     if len(mines) == 0:
         return 1
     return num_correctly_flagged_mines / len(mines)
 
 
+def basic_rule(clue, num_neighbors, num_safe, num_mines, num_hidden):
+    """
+    The basic agent's rule for a single clue, from the counters BasicAgent keeps for it. Flagged neighbors count as
+    mines and as hidden, exploded ones as mines only, so the mine rule can't match a clue with a flagged neighbor.
+
+    :param clue: the clue's number
+    :param num_neighbors: number of cells next to the clue
+    :param num_safe: neighbors revealed safe
+    :param num_mines: neighbors flagged or exploded
+    :param num_hidden: neighbors hidden or flagged
+    :return: FLAGGED if every hidden neighbor is a mine, CLEAR if every hidden neighbor is safe, None otherwise
+    """
+    if num_hidden == 0:
+        return None
+    if clue - num_mines == num_hidden:
+        return FLAGGED
+    if num_neighbors - clue - num_safe == num_hidden:
+        return CLEAR
+    return None
+
+
 class BasicAgent:
-    def __init__(self, arg1, arg2):
+    def __init__(self, arg1, arg2, rng=None, cascade=False):
         """
         Prepare the info that basic agent needs to make inferences. This can be initialized using d, n or board, mines.
 
         :param arg1: either d: board dimension, or board: minesweeper board
         :param arg2: either n: number of mines, or mines: set of mines
+        :param rng: random.Random used for the board and every guess, or None to use the random module
+        :param cascade: open the whole region around every 0 as soon as it is revealed, see query
         """
+        self.rng = rng
+        self.cascade = cascade
         if isinstance(arg1, int) and isinstance(arg2, int):
             d, n = arg1, arg2
-            board, mines = generate_board(d, n)
+            board, mines = generate_board(d, n, rng)
         else:
             board, mines = arg1, arg2
         self.board = board
         self.mines = mines
         d = len(board)
-        self.num_safe_board = [[0 for _ in range(d)] for _ in range(d)]
-        self.num_mines_board = [[0 for _ in range(d)] for _ in range(d)]
-        self.num_hidden_board = [[len(get_neighbor_coordinates((i, j), d)) for j in range(d)] for i in range(d)]
+        self.num_neighbors_board = np.diff(neighbor_table(d).offsets).astype(np.int8).reshape(d, d)
+        self.num_safe_board = np.zeros((d, d), dtype=np.int8)
+        self.num_mines_board = np.zeros((d, d), dtype=np.int8)
+        self.num_hidden_board = self.num_neighbors_board.copy()
+        # Clue cells whose neighborhood changed since they were last checked, starting with every clue on the board
+        self.dirty = deque(np.flatnonzero(board.cells <= 8).tolist())
         self.score = 0
 
+    def update(self, index):
+        """
+        A hidden cell was just revealed or flagged. Update its neighbors' info and queue the clues that changed.
+
+        :param index: flattened index of the cell
+        :return: nothing
+        """
+        cells = self.board.cells.reshape(-1)
+        num_safe, num_mines, num_hidden = (self.num_safe_board.reshape(-1), self.num_mines_board.reshape(-1),
+                                           self.num_hidden_board.reshape(-1))
+        mined = cells[index] == FLAGGED or cells[index] == EXPLODED
+        # A flagged cell counts as a mine but is still counted as hidden, which is what the rules in infer expect
+        uncovered = cells[index] != FLAGGED
+        for neighbor in neighbor_table(len(self.board)).neighbor_indices(index):
+            if mined:
+                num_mines[neighbor] += 1
+            else:
+                num_safe[neighbor] += 1
+            if uncovered:
+                num_hidden[neighbor] -= 1
+            if cells[neighbor] <= 8:
+                self.dirty.append(neighbor)
+        if not mined:
+            self.dirty.append(index)
+
+    def reveal(self, index):
+        """
+        Queries a hidden cell and updates the info around every cell that got uncovered.
+
+        :param index: flattened index of the cell
+        :return: nothing
+        """
+        revealed = [] if self.cascade else None
+        self.board = query(divmod(index, len(self.board)), self.board, self.mines, revealed)
+        for k in revealed if self.cascade else [index]:
+            self.update(k)
+
     def infer(self):
         """
-        Use individual cell inference to mark hidden cells as safe or mined. If we can mark any safe cells and the board
-        hasn't been completed yet, repeat inference.
+        Use individual cell inference to mark hidden cells as safe or mined. Only clues whose neighborhood changed are
+        checked, in board order, and every mark is made at once. Flagged cells still count as hidden, so a flag can stop
+        a later clue's rule from matching and the order matters. A clue queued further on in the board is checked in
+        the same pass and one queued behind it in the next, the same as scanning the whole board again and again.
 
         :return: nothing
         """
+        table = neighbor_table(len(self.board))
+        cells = self.board.cells.reshape(-1)
+        num_neighbors, num_safe, num_mines, num_hidden = (self.num_neighbors_board.reshape(-1),
+                                                          self.num_safe_board.reshape(-1),
+                                                          self.num_mines_board.reshape(-1),
+                                                          self.num_hidden_board.reshape(-1))
         d = len(self.board)
-        new_clues = False  # new clue(s) revealed: if board isn't completed then we should infer again
-        for i in range(d):
-            for j in range(d):
-                if self.board[i][j].isdigit():
-                    if int(self.board[i][j]) - self.num_mines_board[i][j] == self.num_hidden_board[i][j]:
-                        # every hidden neighbor is a mine
-                        for ni, nj in get_neighbor_coordinates((i, j), d):
-                            if self.board[ni][nj] == '?':
-                                self.board[ni][nj] = 'M'
-                                for ni2, nj2 in get_neighbor_coordinates((ni, nj), d):
-                                    self.num_mines_board[ni2][nj2] += 1
-                    elif len(get_neighbor_coordinates((i, j), d)) - int(self.board[i][j]) - self.num_safe_board[i][j] == \
-                            self.num_hidden_board[i][j]:
-                        # every hidden neighbor is safe
-                        for ni, nj in get_neighbor_coordinates((i, j), d):
-                            if self.board[ni][nj] == '?':
-                                self.board[ni][nj] = 'C'
-                                self.board = query((ni, nj), self.board, self.mines)
-                                new_clues = True
-                                for ni2, nj2 in get_neighbor_coordinates((ni, nj), d):
-                                    self.num_safe_board[ni2][nj2] += 1
-                                    self.num_hidden_board[ni2][nj2] -= 1
-        if new_clues and not completed(self.board):
-            self.infer()
+        next_pass = set(self.dirty)
+        self.dirty.clear()
+        while next_pass:
+            queued, next_pass = next_pass, set()
+            this_pass = sorted(queued)
+            while this_pass:
+                index = heappop(this_pass)
+                clue = cells[index]
+                rule = None if clue > 8 else basic_rule(clue, num_neighbors[index], num_safe[index], num_mines[index],
+                                                        num_hidden[index])
+                if rule == FLAGGED:
+                    # every hidden neighbor is a mine
+                    for neighbor in table.neighbor_indices(index):
+                        if cells[neighbor] == HIDDEN:
+                            self.board = flag(divmod(neighbor, d), self.board)
+                            self.update(neighbor)
+                elif rule == CLEAR:
+                    # every hidden neighbor is safe
+                    for neighbor in table.neighbor_indices(index):
+                        if cells[neighbor] == HIDDEN:
+                            self.reveal(neighbor)
+                for changed in self.dirty:
+                    if changed <= index:
+                        next_pass.add(changed)
+                    elif changed not in queued:
+                        queued.add(changed)
+                        heappush(this_pass, changed)
+                self.dirty.clear()
 
     def run(self):
         """
@@ -223,38 +524,95 @@ class BasicAgent:
 
         :return: nothing
         """
-        d = len(self.board)
         while not completed(self.board):
             self.infer()
             if not completed(self.board):
                 # reveal random cell and update info
-                self.board, (i, j) = random_query(self.board, self.mines)
-                for ni, nj in get_neighbor_coordinates((i, j), d):
-                    if self.board[i][j] == 'X':
-                        # blew up mine, update neighbor's info appropriately
-                        self.num_mines_board[ni][nj] += 1
-                    else:
-                        # found safe cell, update neighbor's info appropriately
-                        self.num_safe_board[ni][nj] += 1
-                    self.num_hidden_board[ni][nj] -= 1
+                self.reveal(self.board.hidden.pick(self.rng))
         self.score = get_score(self.board, self.mines)
         # print_board(self.board)
         # print('Score: ' + str(self.score))
 
 
+def cells_to_bits(cells, d):
+    """
+    Packs cells into a bitset, bit i * d + j is set for cell (i, j).
+
+    :param cells: iterable of i, j tuples
+    :param d: board dimension
+    :return: int bitset
+    """
+    bits = 0
+    for i, j in cells:
+        bits |= 1 << (i * d + j)
+    return bits
+
+
+def bit_indices(bits):
+    """
+    :param bits: int bitset
+    :return: generator of the flattened indices of the set bits, lowest first
+    """
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def bits_to_cells(bits, d):
+    """
+    :param bits: int bitset
+    :param d: board dimension
+    :return: set of the i, j tuples of the set bits
+    """
+    return set(divmod(index, d) for index in bit_indices(bits))
+
+
 class Info:
     # This class stores information about cells we know are safe or mined
-    def __init__(self, mines=None, safe=None):
-        if safe is None:
-            safe = set()
-        if mines is None:
-            mines = set()
-        self.mines = mines
-        self.safe = safe
+    # Cells are kept as int bitsets over flattened cell indices, so merging and checking for conflicts are single
+    # big int operations
+    def __init__(self, dim, mines=0, safe=0):
+        """
+        :param dim: board dimension
+        :param mines: int bitset of the mined cells
+        :param safe: int bitset of the safe cells
+        """
+        self.dim = dim
+        self.mine_bits = mines
+        self.safe_bits = safe
 
     def __repr__(self):
-        return "Mines: " + ' '.join(str(mine) for mine in self.mines) + "\n" + "Safe: " + ' '.join(
-            str(s) for s in self.safe)
+        return "Mines: " + ' '.join(str(mine) for mine in sorted(self.mine_cells())) + "\n" + "Safe: " + ' '.join(
+            str(s) for s in sorted(self.safe_cells()))
+
+    def mine_cells(self):
+        """
+        :return: frozenset of the mined i, j tuples
+        """
+        return frozenset(bits_to_cells(self.mine_bits, self.dim))
+
+    def safe_cells(self):
+        """
+        :return: frozenset of the safe i, j tuples
+        """
+        return frozenset(bits_to_cells(self.safe_bits, self.dim))
+
+    def add_mine(self, cell):
+        """
+        Marks a cell as mined, checking it against what is known
+        :param cell: i, j tuple
+        :return: Nothing
+        """
+        self.combine(Info(self.dim, mines=1 << (cell[0] * self.dim + cell[1])))
+
+    def add_safe(self, cell):
+        """
+        Marks a cell as safe, checking it against what is known
+        :param cell: i, j tuple
+        :return: Nothing
+        """
+        self.combine(Info(self.dim, safe=1 << (cell[0] * self.dim + cell[1])))
 
     def combine(self, info):
         """
@@ -262,42 +620,132 @@ class Info:
         :param info: Another Info object
         :return: Nothing
         """
-        if len(info.mines) + len(info.safe) != len(info.mines.union(info.safe)):
+        if info.mine_bits & info.safe_bits:
             raise Exception("Some cells are both safe and mines!")
-        if len(self.mines.intersection(info.safe)) != 0:
+        if self.mine_bits & info.safe_bits:
             raise Exception("Clue conflict 1")
-        if len(self.safe.intersection(info.mines)) != 0:
+        if self.safe_bits & info.mine_bits:
             raise Exception("Clue conflict 2")
-        self.mines = self.mines.union(info.mines)
-        self.safe = self.safe.union(info.safe)
+        self.mine_bits |= info.mine_bits
+        self.safe_bits |= info.safe_bits
 
     def has_new(self):
         """
         Checks if there is new information that can be used
         :return: True if so, False otherwise
         """
-        return len(self.mines) != 0 or len(self.safe) != 0
+        return self.mine_bits != 0 or self.safe_bits != 0
+
+    def count(self):
+        """
+        :return: The number of cells we know about
+        """
+        return self.mine_bits.bit_count() + self.safe_bits.bit_count()
+
+
+class PatternCache:
+    # The 8 rotations and reflections of the board, as (a, b, c, e) taking (i, j) to (a * i + b * j, c * i + e * j)
+    SYMMETRIES = [(1, 0, 0, 1), (0, 1, -1, 0), (-1, 0, 0, -1), (0, -1, 1, 0),
+                  (1, 0, 0, -1), (-1, 0, 0, 1), (0, 1, 1, 0), (0, -1, -1, 0)]
+
+    def __init__(self, cache_size=4096, max_cells=8):
+        """
+        Remembers the reduced rows of small groups of equations. The same shapes turn up all the time, a 1 next to two
+        hidden cells, 1-2-1 walls, corners, so each group is put in a canonical form that doesn't change when it is
+        moved, rotated or reflected, and a group seen before is mapped back from the stored rows instead of reduced
+        again. The RREF depends on the order of the columns, so rows are stored for each order the cells come in. One
+        cache can be shared by every game in a process.
+
+        :param cache_size: how many groups to keep, the least recently used are dropped first
+        :param max_cells: groups with more hidden cells than this are never cached
+        """
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.max_cells = max_cells
+        self.hits = 0
+        self.misses = 0
+
+    def canonical(self, rows, dim):
+        """
+        Finds the canonical form of a group: every symmetry is tried, the cells are moved so the smallest row and
+        column are 0, and the symmetry giving the smallest sorted list of rows wins, the first one on a tie
+        Positions are stored as i * 256 + j, a group would need over 100 cells to span that far. Comparing the sorted
+        positions first means the rows only have to be sorted for the symmetries that tie on them
+        :param rows: list of (coefficients, right hand side) pairs, coefficients keyed by flattened cell index
+        :param dim: board dimension
+        :return: the canonical rows, and a dictionary from each cell index to its canonical position
+        """
+        cells = list(set(index for coefs, _ in rows for index in coefs))
+        coordinates = [divmod(index, dim) for index in cells]
+        best_shape, candidates = None, []
+        for a, b, c, e in self.SYMMETRIES:
+            moved = [(a * i + b * j, c * i + e * j) for i, j in coordinates]
+            min_i = min(i for i, _ in moved)
+            min_j = min(j for _, j in moved)
+            positions = [(i - min_i) * 256 + j - min_j for i, j in moved]
+            shape = sorted(positions)
+            if best_shape is None or shape < best_shape:
+                best_shape, candidates = shape, [positions]
+            elif shape == best_shape:
+                candidates.append(positions)
+
+        best, best_position = None, None
+        for positions in candidates:
+            position = dict(zip(cells, positions))
+            key = tuple(sorted((tuple(sorted((position[index], value) for index, value in coefs.items())), num_mines)
+                               for coefs, num_mines in rows))
+            if best is None or key < best:
+                best, best_position = key, position
+        return best, best_position
+
+    def get(self, key):
+        """
+        :param key: canonical rows of a group, and the canonical positions of its cells in board order
+        :return: the stored reduced rows for the group, None if there aren't any
+        """
+        reduced = self.cache.get(key)
+        if reduced is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return reduced
+
+    def put(self, key, reduced):
+        """
+        :param key: canonical rows of a group, and the canonical positions of its cells in board order
+        :param reduced: reduced rows of the group, coefficients keyed by canonical position
+        :return: nothing
+        """
+        self.cache[key] = reduced
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def cache_info(self):
+        """
+        :return: dictionary of hits, misses, groups stored and the most that can be stored
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'cache_size': self.cache_size}
+
+
+# One cache for every game in the process to share
+PATTERNS = PatternCache()
 
 
 class ClueSolver:
     # Clue represents the information around a single cell with a number
     class Clue:
-        def __init__(self, num_mines, hidden_cells, mined_cells):
-            self.num_mines = num_mines - mined_cells
-            self.hidden_cells = hidden_cells
-
-        def gen_row(self, dim):
+        def __init__(self, num_mines, hidden_cells, mined_cells, dim):
             """
-            Generates the row representation of the equation a clue represents of the form
-            (sum a_{i * dim + j} = b) where a is 1 if cell (i, j) is hidden, 0 o/w, b is clue value
-            :param dim: Dimension of the board
-            :return: The row representing the equation
+            :param num_mines: The clue number
+            :param hidden_cells: The hidden cells around the clue, as a set of i, j tuples or an int bitset
+            :param mined_cells: Number of mined cells around the clue
+            :param dim: board dimension
             """
-            row = [0] * (dim * dim + 1)
-            for cell in self.hidden_cells:
-                row[cell[0] * dim + cell[1]] = 1
-            row[-1] = self.num_mines
-            return row
+            self.num_mines = num_mines - mined_cells
+            self.hidden = hidden_cells if isinstance(hidden_cells, int) else cells_to_bits(hidden_cells, dim)
+            self.size = self.hidden.bit_count()
+            self.dim = dim
 
         def solve(self):
             """
@@ -307,18 +755,51 @@ class ClueSolver:
             Otherwise, there is no new information
             :return: an Info object containing any new information
             """
-            if self.num_mines == len(self.hidden_cells):
-                return Info(mines=self.hidden_cells)
+            if self.num_mines == self.size:
+                return Info(self.dim, mines=self.hidden)
             elif self.num_mines == 0:
-                return Info(safe=self.hidden_cells)
+                return Info(self.dim, safe=self.hidden)
             else:
-                return Info()
-
-    def __init__(self, dim, info):
-        self.clues = []
+                return Info(self.dim)
+
+    def __init__(self, dim, info, backend=DEFAULT_BACKEND, patterns=None, pattern_db=None, max_cells=None,
+                 executor=None, parallel_cells=32):
+        # The solver is a knowledge base that lives for a whole game: clues are keyed by the cell that gave them, and
+        # the reduced rows from the last solve are kept so the next solve only redoes the groups that changed.
+        # backend names the function in linalg.BACKENDS that does the row reduction, patterns is an optional
+        # PatternCache of groups reduced before and pattern_db an optional patterndb.PatternDatabase. Groups with more
+        # than max_cells cells, or any group once perf_counter passes deadline, are left unreduced, and groups with more
+        # than parallel_cells cells are reduced on executor if there is one, see generate_sympy
+        self.clues = {}
+        self.cell_clues = {}
+        self.new_clues = set()
+        # Clues that changed since pairs were last compared
+        self.changed_clues = set()
+        self.rows = {}
+        self.cell_rows = {}
+        self.dirty_rows = set()
+        self.next_key = 0
         self.dim = dim
-        self.dense_to_sparse = {}
         self.selection = info[1]
+        self.rref = BACKENDS[backend]
+        self.patterns = patterns
+        self.pattern_db = pattern_db
+        self.max_cells = max_cells
+        self.deadline = None
+        self.executor = executor
+        # Smaller groups are quicker to reduce than to send to another process, and pattern cache sized groups need
+        # to be reduced here in their canonical order
+        self.parallel_cells = max(parallel_cells, patterns.max_cells if patterns is not None else 0)
+        # Mines left among the hidden cells and the hidden cells as a bitset, when the total is known, see set_global
+        self.global_mines = None
+        self.global_hidden = 0
+        self.engine = None
+        # Largest group solve_global counts exactly, bigger ones only get bounds
+        self.exact_cells = 24
+        # Groups left unreduced because they were over budget, over the whole game
+        self.num_skipped = 0
+        # Counters to add to while an agent is being traced, None otherwise
+        self.stats = None
 
     def index_to_cell(self, index):
         """
@@ -328,132 +809,655 @@ class ClueSolver:
         """
         return index // self.dim, index % self.dim
 
-    def add_clue(self, num_mines, hidden_cells, mined_cells):
+    def set_global(self, num_mines, hidden_cells, mined_cells):
+        """
+        Tells the solver how many mines the whole board has. This is kept apart from the clues rather than as one more
+        clue over every hidden cell, which would join every group into one as wide as the board, and is only used by
+        solve_global once the clues have been reduced
+        :param num_mines: Total number of mines
+        :param hidden_cells: Every hidden cell, as a set of i, j tuples or an int bitset
+        :param mined_cells: Number of cells already flagged or exploded
+        :return: Nothing, updates self
+        """
+        self.global_mines = num_mines - mined_cells
+        self.global_hidden = hidden_cells if isinstance(hidden_cells, int) else cells_to_bits(hidden_cells, self.dim)
+        self.engine = ProbabilityEngine()
+
+    def add_clue(self, num_mines, hidden_cells, mined_cells, key=None):
         """
         Given the number of mines, hidden cells, and mined cells, adds clue to list of clues
         :param num_mines: The clue number (how many mines are around it)
-        :param hidden_cells: Number of hidden cells around clue
+        :param hidden_cells: Hidden cells around clue, as a set of i, j tuples or an int bitset
         :param mined_cells: Number of mined cells around clue
+        :param key: What the clue is stored under, usually the cell it came from. A new key is made if not given
         :return: Nothing, adds clue to self
         """
+        clue = self.Clue(num_mines, hidden_cells, mined_cells, self.dim)
         # If there is nothing hidden, we have nothing to learn, so ignore it
-        if len(hidden_cells) == 0:
+        if clue.size == 0:
             return
-        self.clues.append(self.Clue(num_mines, hidden_cells, mined_cells))
+        if key is None:
+            key = self.next_key
+            self.next_key += 1
+        self.clues[key] = clue
+        self.new_clues.add(key)
+        self.changed_clues.add(key)
+        for index in bit_indices(clue.hidden):
+            self.cell_clues.setdefault(index, set()).add(key)
+
+    def resolve_cell(self, cell, mined):
+        """
+        A hidden cell has been revealed or flagged, so take it out of every clue and reduced row that mentions it
+        Clues with nothing hidden left are retired, and changed rows are marked to be reduced again
+        :param cell: The cell that is no longer hidden
+        :param mined: True if the cell turned out to be a mine, False if it was safe
+        :return: Nothing, updates self
+        """
+        index = cell[0] * self.dim + cell[1]
+        if self.global_mines is not None and self.global_hidden >> index & 1:
+            self.global_hidden &= ~(1 << index)
+            if mined:
+                self.global_mines -= 1
+        for key in self.cell_clues.pop(index, ()):
+            clue = self.clues[key]
+            clue.hidden &= ~(1 << index)
+            clue.size -= 1
+            if mined:
+                clue.num_mines -= 1
+            if clue.size == 0:
+                del self.clues[key]
+                self.new_clues.discard(key)
+                self.changed_clues.discard(key)
+            else:
+                self.changed_clues.add(key)
+
+        for row_id in self.cell_rows.pop(index, ()):
+            coefs, num_mines = self.rows[row_id]
+            e = coefs.pop(index)
+            if mined:
+                self.rows[row_id][1] = num_mines - e
+            if len(coefs) == 0:
+                self.remove_row(row_id)
+            else:
+                self.dirty_rows.add(row_id)
 
-    def get_next_cell(self, sympy_mat):
+    def add_row(self, coefs, num_mines):
+        """
+        Stores a row of the reduced knowledge base
+        :param coefs: Dictionary from flattened cell index to its (nonzero) coefficient
+        :param num_mines: The right hand side of the equation
+        :return: The id of the new row
+        """
+        row_id = self.next_key
+        self.next_key += 1
+        self.rows[row_id] = [coefs, num_mines]
+        for index in coefs:
+            self.cell_rows.setdefault(index, set()).add(row_id)
+        return row_id
+
+    def remove_row(self, row_id):
+        """
+        Removes a row of the reduced knowledge base
+        :param row_id: The id of the row
+        :return: Nothing, updates self
+        """
+        for index in self.rows.pop(row_id)[0]:
+            row_ids = self.cell_rows.get(index)
+            if row_ids is not None:
+                row_ids.discard(row_id)
+                if len(row_ids) == 0:
+                    del self.cell_rows[index]
+        self.dirty_rows.discard(row_id)
+
+    def get_components(self, row_ids):
+        """
+        Splits rows into independent groups. Two rows are in the same group if they share a hidden cell, directly or
+        through other rows, so the equations of one group never involve the cells of another
+        :param row_ids: The rows to split
+        :return: A list of groups, each a list of row ids
+        """
+        return group_connected(row_ids, lambda row_id: self.rows[row_id][0])
+
+    def get_next_cell(self):
         """
         For the bonus, picks the next best cell to use
         Once we solve the matrix, we pick the cell included in the MOST number of constraints
         This maximizes the amount of other clues we may be able to solve next
-        :param sympy_mat: The RREF'd sympy matrix
         :return: The cell which is in the most number of constraints (equations)
         """
         max_constraint, max_cell = -1, -1
         if self.selection:
-            for i in range(sympy_mat.cols - 1):
-                if sum(sympy_mat.col(i)) > max_constraint:
-                    max_constraint = sum(sympy_mat.col(i))
-                    max_cell = i
+            # Visit cells in board order, the same order they would have as columns of one big matrix
+            for index in sorted(self.cell_rows):
+                col_sum = sum(self.rows[row_id][0][index] for row_id in self.cell_rows[index])
+                if col_sum > max_constraint:
+                    max_constraint = col_sum
+                    max_cell = index
 
-        return (-1, -1) if max_cell == -1 else self.index_to_cell(self.dense_to_sparse[max_cell])
+        return (-1, -1) if max_cell == -1 else self.index_to_cell(max_cell)
 
     def generate_sympy(self):
         """
         Once we have all the clues, we want to combine them all to perform inference
-        This method does just that and returns the matrix which represents our knowledge base
-        :return: The matrix
-        """
-        sparse_mat, dense_mat = [], []
-        empty_col = [True] * (self.dim * self.dim) + [False]
-
-        # For each clue, add the row form of it to the matrix
-        for clue in self.clues:
-            sparse_mat.append(clue.gen_row(self.dim))
-
-        # The matrix could be very big, so we make it small by removing all columns with only 0s
-        for row in sparse_mat:
-            for i, e in enumerate(row):
-                if e != 0:
-                    empty_col[i] = False
-
-        # Track which column in the dense matrix corresponds to in the sparse matrix for conversion later
-        self.dense_to_sparse = {}
-        filled_col, cur_col = set(), 0
-        for i, e in enumerate(empty_col):
-            if not e:
-                self.dense_to_sparse[cur_col] = i
-                cur_col += 1
-                filled_col.add(i)
-        filled_col.add(self.dim * self.dim)
-
-        # Generate the dense matrix which has no column with only 0s
-        for row in sparse_mat:
-            dense_mat.append([e for i, e in enumerate(row) if i in filled_col])
+        Clues that share no hidden cells can't tell each other anything, so each group of connected rows gets its own
+        small matrix instead of one big one. Groups that haven't changed since the last call are already reduced, so
+        only groups with new clues or newly revealed cells are built from their old reduced rows and RREF'd again
+        Groups too big for max_cells, or left when the deadline passes, are skipped, so one call never takes much
+        longer than the budget. With an executor, groups with more than parallel_cells cells are reduced in other
+        processes while the rest are reduced here, giving the same rows as reducing them all here
+        The name is historical, the RREF is done by whichever backend the solver was made with
+        :return: Nothing, the reduced rows are kept in self.rows
+        """
+        for key in self.new_clues:
+            clue = self.clues[key]
+            row_id = self.add_row({index: 1 for index in bit_indices(clue.hidden)}, clue.num_mines)
+            self.dirty_rows.add(row_id)
+        self.new_clues = set()
+
+        # Only groups touching a changed row need work, so grow the changed rows into their whole groups
+        row_ids, frontier = set(self.dirty_rows), list(self.dirty_rows)
+        while frontier:
+            for index in self.rows[frontier.pop()][0]:
+                for row_id in self.cell_rows[index]:
+                    if row_id not in row_ids:
+                        row_ids.add(row_id)
+                        frontier.append(row_id)
+        self.dirty_rows = set()
+
+        # Smallest groups first, so running out of time leaves the expensive ones
+        groups = [(group, set(index for row_id in group for index in self.rows[row_id][0]))
+                  for group in self.get_components(row_ids)]
+        groups.sort(key=lambda group: len(group[1]))
+        # The reduced rows of each group, or a future for them if the group went to the executor
+        reduced = []
+        for group, cells in groups:
+            if (self.max_cells is not None and len(cells) > self.max_cells) or \
+                    (self.deadline is not None and time.perf_counter() > self.deadline):
+                # Over budget, the rows are still true as they are, so solve_improved reads what it can off them. They
+                # stay dirty to be reduced by a later call, once the group has shrunk or there is time
+                self.dirty_rows.update(group)
+                self.num_skipped += 1
+                if self.stats is not None:
+                    self.stats['skipped'] += 1
+                continue
+            rows = []
+            for row_id in group:
+                rows.append(tuple(self.rows[row_id]))
+                self.remove_row(row_id)
+            if self.executor is not None and len(cells) > self.parallel_cells:
+                # Big enough to be worth sending to another process, reduced with the same columns as reduce_group
+                # would use so the rows come back the same
+                if self.stats is not None:
+                    self.stats['groups'] += 1
+                    self.stats['rows'] += len(rows)
+                    self.stats['cols'] += len(cells)
+                    self.stats['parallel'] += 1
+                reduced.append(self.executor.submit(self.rref, rows, sorted(cells)))
+            else:
+                reduced.append(self.reduce_group(rows))
+
+        # Rows are added back in group order whichever group finished first, so they get the same ids as when every
+        # group is reduced here
+        for rows in reduced:
+            if not isinstance(rows, list):
+                if self.stats is not None:
+                    start = time.perf_counter()
+                rows = rows.result()
+                if self.stats is not None:
+                    self.stats['rref_s'] += time.perf_counter() - start
+            for coefs, num_mines in rows:
+                self.add_row(coefs, num_mines)
+
+    def reduce_group(self, rows):
+        """
+        RREFs one group of rows, with its columns in board order so it matches its block of the full matrix. Small
+        groups go through the pattern cache if there is one. The RREF depends on the column order, so the key is the
+        canonical rows together with the order the board puts their cells in: a group moved anywhere on the board
+        reduces the same way, and a turned one only shares rows with groups whose cells come in the same order. Either
+        way the rows are the ones reducing the group here would give
+        :param rows: list of (coefficients, right hand side) pairs
+        :return: list of reduced (coefficients, right hand side) pairs
+        """
+        columns = sorted(set(index for coefs, _ in rows for index in coefs))
+        if self.patterns is not None and len(columns) <= self.patterns.max_cells:
+            key, position = self.patterns.canonical(rows, self.dim)
+            key = (key, tuple(position[index] for index in columns))
+            reduced = self.patterns.get(key)
+            if reduced is not None:
+                if self.stats is not None:
+                    self.stats['pattern_hits'] += 1
+                cell_at = {p: index for index, p in position.items()}
+                return [({cell_at[p]: e for p, e in coefs.items()}, num_mines) for coefs, num_mines in reduced]
+        else:
+            key, position = None, None
 
         # RREF matrix to simplify and obtain solutions
-        sympy_mat = sympy.Matrix(dense_mat)
-        return sympy_mat.rref()[0]
+        if self.stats is not None:
+            self.stats['groups'] += 1
+            self.stats['rows'] += len(rows)
+            self.stats['cols'] += len(columns)
+            start = time.perf_counter()
+        reduced = self.rref(rows, columns)
+        if self.stats is not None:
+            self.stats['rref_s'] += time.perf_counter() - start
+        if key is not None:
+            self.patterns.put(key, [({position[index]: e for index, e in coefs.items()}, num_mines)
+                                    for coefs, num_mines in reduced])
+        return reduced
 
     def solve_basic(self):
         """
         This solves the clues using the basic agent strategy.
         :return: The solution as an Info object storing the new information
         """
-        sol = Info()
-        for clue in self.clues:
-            sol.combine(clue.solve())
+        sol = Info(self.dim)
+        for clue in self.clues.values():
+            if clue.num_mines == clue.size or clue.num_mines == 0:
+                sol.combine(clue.solve())
         return sol, None
 
+    def solve_windows(self):
+        """
+        Looks up every pair of nearby clues with a changed clue in the pattern database, which gives everything the two
+        clues force between them in one read. Only clues that came from a cell are looked up, the database doesn't
+        know about any other kind. changed_clues is left for solve_pairwise, which clears it
+        :return: The solution as an Info object storing the new information
+        """
+        sol = Info(self.dim)
+        for key in sorted(self.changed_clues, key=str):
+            if not isinstance(key, tuple):
+                continue
+            clue = self.clues[key]
+            others = set()
+            for index in bit_indices(clue.hidden):
+                others.update(self.cell_clues[index])
+            for other in sorted(others, key=str):
+                if not isinstance(other, tuple) or other == key:
+                    continue
+                first, second = (key, other) if key < other else (other, key)
+                if (second[0] - first[0], second[1] - first[1]) not in self.pattern_db.windows:
+                    continue
+                mines, safe = self.pattern_db.lookup(self.dim, first, self.clues[first], second, self.clues[second])
+                if mines or safe:
+                    sol.combine(Info(self.dim, mines=mines, safe=safe))
+        return sol
+
+    def solve_pairwise(self):
+        """
+        This compares every pair of clues that share a hidden cell. If B has exactly as many more mines than A as it
+        has cells that A doesn't, then every one of those cells is a mine and A's mines are all in the cells they
+        share, so A's other cells are safe. A being a subset of B is the usual case of this
+        Much cheaper than building and reducing the matrix, so it is tried first. A pair that told us nothing last time
+        tells us nothing until one of its clues changes, so only pairs with a changed clue are compared
+        :return: The solution as an Info object storing the new information
+        """
+        sol = Info(self.dim)
+        # Keys can mix ints and tuples, so sort them as strings
+        for key in sorted(self.changed_clues, key=str):
+            clue = self.clues[key]
+            others = set()
+            for index in bit_indices(clue.hidden):
+                others.update(self.cell_clues[index])
+            others.discard(key)
+            for other in sorted(others, key=str):
+                for a, b in (clue, self.clues[other]), (self.clues[other], clue):
+                    only_b = b.size - (a.hidden & b.hidden).bit_count()
+                    if only_b != 0 and b.num_mines - a.num_mines == only_b:
+                        sol.combine(Info(self.dim, mines=b.hidden & ~a.hidden, safe=a.hidden & ~b.hidden))
+        self.changed_clues = set()
+        return sol
+
     def solve_improved(self):
         """
         This uses the matrix form of our knowledge base after inference has been performed
-        Reverses the compression to the dense matrix, and solves the clues
+        Maps each row's columns back to their cells, and solves the clues
         :return: The solution, in the form of Info object, as well as the next cell to pick if needed
         """
-        sympy_mat = self.generate_sympy()
+        self.generate_sympy()
 
-        # Use solved matrix to check for new information
-        sol = Info()
-        for sympy_row in sympy_mat.tolist():
-            # Expand row back into long form
-            row = [0] * (self.dim * self.dim + 1)
-            for i, e in enumerate(sympy_row):
-                row[self.dense_to_sparse[i]] = e
+        # Use solved matrices to check for new information
+        sol = Info(self.dim)
+        for coefs, num_mines in self.rows.values():
+            row = coefs.values()
             # Deduce the clues
-            if sum([i for i in row[:-1] if i < 0]) == 0:
-                clue = self.Clue(row[-1], set(self.index_to_cell(i) for i, e in enumerate(row[:-1]) if e != 0),
-                                 sum([i - 1 for i in row[:-1] if i > 1]))
+            if sum([i for i in row if i < 0]) == 0:
+                hidden = 0
+                for index in coefs:
+                    hidden |= 1 << index
+                clue = self.Clue(num_mines, hidden, sum([i - 1 for i in row if i > 1]), self.dim)
                 sol.combine(clue.solve())
 
-        return sol, self.get_next_cell(sympy_mat)
+        return sol, self.get_next_cell()
+
+    def solve_global(self):
+        """
+        Uses how many mines are left once the clues can't tell us any more. Clues split into independent groups, and
+        each group gets the fewest and most mines it can hold. For most groups these are bounds from clues that share
+        no cells: together they hold exactly their mines, and the rest of the group's cells hold anywhere from none to
+        all. Groups of at most exact_cells cells are counted exactly instead, by how many mines their solutions use.
+        The cells no clue touches hold whatever the groups leave, so they are all safe if the groups need every mine
+        left and all mines if the groups can take no more than they need. Each exactly counted group is held to the
+        range the others leave it, and a cell that is a mine, or safe, in every solution of its group in that range is
+        decided. Groups over max_cells are never counted, and the tier does nothing once the deadline has passed
+        :return: The solution as an Info object storing the new information
+        """
+        sol = Info(self.dim)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            return sol
+        clues = list(self.clues.values())
+        frontier = 0
+        for clue in clues:
+            frontier |= clue.hidden
+        num_other = (self.global_hidden & ~frontier).bit_count()
+        exact_cells = self.exact_cells if self.max_cells is None else min(self.exact_cells, self.max_cells)
+
+        # (fewest mines, most mines, exact counts or None) for each group
+        groups = []
+        for group in group_connected(clues, lambda clue: bit_indices(clue.hidden)):
+            cells = 0
+            for clue in group:
+                cells |= clue.hidden
+            size = cells.bit_count()
+            if size <= exact_cells and (self.deadline is None or time.perf_counter() <= self.deadline):
+                counts = self.engine.group_counts([(clue.hidden, clue.num_mines) for clue in group])
+                feasible = [k for k, count in enumerate(counts[0]) if count]
+                if not feasible:
+                    # The clues contradict each other, nothing can be trusted
+                    return sol
+                groups.append((feasible[0], feasible[-1], counts))
+            else:
+                used, packed = 0, 0
+                for clue in sorted(group, key=lambda clue: -clue.num_mines):
+                    if not clue.hidden & used:
+                        used |= clue.hidden
+                        packed += clue.num_mines
+                groups.append((packed, packed + size - used.bit_count(), None))
+        least = sum(low for low, _, _ in groups)
+        most = sum(high for _, high, _ in groups)
+        remaining = self.global_mines
+
+        for low, high, counts in groups:
+            if counts is None:
+                continue
+            total, cell_counts = counts
+            # Mines this group can hold, given what the others and the untouched cells can hold
+            low, high = max(low, remaining - num_other - (most - high)), min(high, remaining - (least - low))
+            sizes = [k for k in range(low, high + 1) if total[k]]
+            if not sizes:
+                return sol
+            mines, safe = 0, 0
+            for index, cell_total in cell_counts.items():
+                mined = [cell_total[k] if k < len(cell_total) else 0 for k in sizes]
+                if all(count == total[k] for count, k in zip(mined, sizes)):
+                    mines |= 1 << index
+                elif not any(mined):
+                    safe |= 1 << index
+            sol.combine(Info(self.dim, mines=mines, safe=safe))
+
+        if num_other:
+            other = self.global_hidden & ~frontier
+            if remaining - least <= 0:
+                sol.combine(Info(self.dim, safe=other))
+            elif remaining - most >= num_other:
+                sol.combine(Info(self.dim, mines=other))
+        return sol
 
     def solve(self):
         """
-        This attempts to solve the board. First it uses the basic algorithm. If there is no new info, it uses improved.
+        This attempts to solve the board. First it uses the basic algorithm. If there is no new info, it looks up nearby
+        pairs of clues in the pattern database if there is one, then compares pairs of clues, and if that finds nothing
+        either, it uses improved, and then the global mine count if it is known.
         :return: The solution and the next cell to pick
         """
+        if self.stats is not None:
+            self.stats['solves'] += 1
+            self.stats['clues'] += len(self.clues)
         sol, _ = self.solve_basic()
         if sol.has_new():
+            if self.stats is not None:
+                self.stats['basic'] += sol.count()
+            return sol, (-1, -1)
+        if self.pattern_db is not None:
+            sol = self.solve_windows()
+            if sol.has_new():
+                if self.stats is not None:
+                    self.stats['windows'] += sol.count()
+                return sol, (-1, -1)
+        sol = self.solve_pairwise()
+        if sol.has_new():
+            if self.stats is not None:
+                self.stats['pairwise'] += sol.count()
             return sol, (-1, -1)
         else:
             if False:
                 print("Using inference")
-            return self.solve_improved()
+            sol, next_cell = self.solve_improved()
+            if self.stats is not None:
+                self.stats['improved'] += sol.count()
+            if not sol.has_new() and self.global_mines is not None:
+                sol = self.solve_global()
+                if self.stats is not None:
+                    self.stats['global'] += sol.count()
+            return sol, next_cell
+
+
+class ProbabilityEngine:
+    def __init__(self, cache_size=256):
+        """
+        Works out the exact chance that each hidden cell is a mine, given the clues and how many mines are left.
+        Clues are split into independent groups and the solutions of each group are counted by how many mines they use.
+        Groups are then weighed against each other by the number of ways to place the remaining mines in the cells
+        no clue touches. Counts for a group are cached, so groups that didn't change since the last guess are free.
+
+        :param cache_size: how many groups to keep counts for
+        """
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    @staticmethod
+    def count_group(constraints):
+        """
+        Counts the solutions of one group of clues by the number of mines they use, and for each cell, the solutions
+        where that cell is a mine. Cells are decided one at a time, and the state after each cell is just what is
+        still needed by the clues that have been started but not finished, so solutions sharing a state are counted
+        together rather than listed one by one.
+
+        :param constraints: list of (int bitset of cells, number of mines among those cells) pairs
+        :return: list of solution counts indexed by number of mines, dictionary from flattened cell index to the same
+            kind of list for solutions where that cell is a mine
+        """
+        # Order cells so clues are finished soon after they are started, keeping the number of states small
+        cell_constraints = {}
+        for j, (cells, _) in enumerate(constraints):
+            for cell in bit_indices(cells):
+                cell_constraints.setdefault(cell, []).append(j)
+        order, seen = [], set()
+        for start in sorted(cell_constraints):
+            if start in seen:
+                continue
+            seen.add(start)
+            frontier = deque([start])
+            while frontier:
+                cell = frontier.popleft()
+                order.append(cell)
+                for j in cell_constraints[cell]:
+                    for other in bit_indices(constraints[j][0]):
+                        if other not in seen:
+                            seen.add(other)
+                            frontier.append(other)
+        position = {cell: t for t, cell in enumerate(order)}
+        m = len(order)
+
+        positions = [sorted(position[cell] for cell in bit_indices(cells)) for cells, _ in constraints]
+        containing = [cell_constraints[cell] for cell in order]
+        # Clues with some cells decided and some not yet decided at each step, these make up the state
+        open_at = [[j for j, p in enumerate(positions) if p[0] < t <= p[-1]] for t in range(m + 1)]
+        # How many cells of each clue come after each step, a clue can't need more mines than that
+        left_after = [{j: sum(1 for p in positions[j] if p > t) for j in containing[t]} for t in range(m)]
+
+        def step(t, state, x):
+            needs = dict(zip(open_at[t], state))
+            for j in containing[t]:
+                need = needs.get(j, constraints[j][1]) - x
+                if need < 0 or need > left_after[t][j]:
+                    return None
+                needs[j] = need
+            return tuple(needs[j] for j in open_at[t + 1])
+
+        def add(counts, other, shift):
+            while len(counts) < len(other) + shift:
+                counts.append(0)
+            for k, c in enumerate(other):
+                counts[k + shift] += c
+
+        # Forward pass: solution counts of the decided cells for every reachable state
+        forward, moves = [{(): [1]}], []
+        for t in range(m):
+            layer, layer_moves = {}, {}
+            for state, counts in forward[t].items():
+                layer_moves[state] = [step(t, state, 0), step(t, state, 1)]
+                for x, nxt in enumerate(layer_moves[state]):
+                    if nxt is not None:
+                        add(layer.setdefault(nxt, []), counts, x)
+            forward.append(layer)
+            moves.append(layer_moves)
+
+        # Backward pass: solution counts of the cells still to decide, from every state that can finish
+        backward = [None] * m + [{(): [1]}]
+        for t in range(m - 1, -1, -1):
+            layer = {}
+            for state in forward[t]:
+                counts = []
+                for x, nxt in enumerate(moves[t][state]):
+                    if nxt is not None and nxt in backward[t + 1]:
+                        add(counts, backward[t + 1][nxt], x)
+                if counts:
+                    layer[state] = counts
+            backward[t] = layer
+
+        total = backward[0].get((), [])
+        cell_counts = {}
+        for t, cell in enumerate(order):
+            counts = []
+            for state, before in forward[t].items():
+                nxt = moves[t][state][1]
+                if nxt is not None and nxt in backward[t + 1]:
+                    after = [0] + backward[t + 1][nxt]
+                    for k, c in enumerate(before):
+                        add(counts, [c * a for a in after], k)
+            cell_counts[cell] = counts
+        return total, cell_counts
+
+    def group_counts(self, constraints):
+        """
+        Counts the solutions of one group of clues, reusing the counts from last time if the group hasn't changed
+        :param constraints: list of (int bitset of cells, number of mines among those cells) pairs
+        :return: the result of count_group
+        """
+        key = frozenset(constraints)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        result = self.count_group(constraints)
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def probabilities(self, clues, num_hidden, num_mines):
+        """
+        Works out the chance that each hidden cell is a mine
+        :param clues: the clues to use, each with its bitset of hidden cells and number of mines still among them
+        :param num_hidden: the number of hidden cells on the whole board
+        :param num_mines: the number of mines among the hidden cells
+        :return: dictionary from the flattened index of each cell some clue touches to its chance of being a mine, and
+            the chance for any other hidden cell (None if there are none). Both are None when no placement of the mines
+            fits the clues
+        """
+        groups = group_connected([(clue.hidden, clue.num_mines) for clue in clues], lambda c: bit_indices(c[0]))
+        results = [self.group_counts(group) for group in groups]
+        num_other = num_hidden - sum(len(cell_counts) for _, cell_counts in results)
+
+        def multiply(a, b):
+            product = [0] * (len(a) + len(b) - 1)
+            for i, x in enumerate(a):
+                if x:
+                    for j, y in enumerate(b):
+                        product[i + j] += x * y
+            return product
+
+        # Mines used by all groups but one, so a cell's own group can be swapped in
+        before, after = [[1]], [[1]]
+        for total, _ in results:
+            before.append(multiply(before[-1], total))
+        for total, _ in reversed(results):
+            after.append(multiply(after[-1], total))
+        after.reverse()
+
+        # Each way the groups use k mines leaves comb(num_other, num_mines - k) ways to place the rest
+        ways = [comb(num_other, num_mines - k) if 0 <= num_mines - k else 0 for k in range(len(before[-1]))]
+
+        def weigh(counts):
+            return sum(c * w for c, w in zip(counts, ways))
+
+        weight = weigh(before[-1])
+        if weight == 0:
+            return None, None
+        probabilities = {}
+        for i, (_, cell_counts) in enumerate(results):
+            others = multiply(before[i], after[i + 1])
+            for cell, counts in cell_counts.items():
+                probabilities[cell] = Fraction(weigh(multiply(others, counts)), weight) if counts else Fraction(0)
+        other = None
+        if num_other > 0:
+            # Expected number of mines outside the clues, spread evenly over those cells
+            expected = sum(c * w * (num_mines - k) for k, (c, w) in enumerate(zip(before[-1], ways)))
+            other = Fraction(expected, weight * num_other)
+        return probabilities, other
 
 
 class ImprovedAgent:
-    def __init__(self, arg1, arg2, info):
+    def __init__(self, arg1, arg2, info, min_risk=False, rng=None, sink=None, backend=DEFAULT_BACKEND,
+                 cascade=False, patterns=None, pattern_db=None, max_cells=None, max_seconds=None, snapshots=None,
+                 executor=None):
         """
         Prepare the info that improved agent needs to make inferences. This can be initialized using d, n or board,
         mines.
 
         :param arg1: either d: board dimension, or board: minesweeper board
         :param arg2: either n: number of mines, or mines: set of mines
+        :param info: (global mine count or -1, use the optimized selection algorithm) with an optional third entry to
+            print a play by play
+        :param min_risk: when forced to guess, query the cell least likely to be a mine instead
+        :param rng: random.Random used for the board and every guess, or None to use the random module
+        :param sink: where to send trace events (see instrument.py), or None to not trace
+        :param backend: name of the row reduction backend in linalg.BACKENDS
+        :param cascade: open the whole region around every 0 as soon as it is revealed, see query
+        :param patterns: PatternCache of groups reduced before, such as PATTERNS, or None to reduce every group. Worth
+            it with the sympy backend, the integer backend reduces small groups about as fast as they can be looked up
+        :param pattern_db: patterndb.PatternDatabase to look nearby pairs of clues up in before comparing them, such as
+            patterndb.load(), or None to not look them up
+        :param max_cells: most cells a group of equations can have to be row reduced, or None for no limit
+        :param max_seconds: most seconds each call to infer spends row reducing before leaving the remaining groups
+            for the cheaper tiers, or None for no limit. A group that has started is always finished, so max_cells is
+            what bounds the slowest move. Games with a time limit depend on how fast the machine is, so
+            they can't be replayed exactly
+        :param snapshots: where to record the clues handed to the solver on every call to infer, such as a
+            snapshot.SnapshotWriter, or None to not record them
+        :param executor: concurrent.futures executor to reduce big independent groups of clues on at the same time, or
+            None to reduce them one after another here. Made once and handed to every game, a process pool keeps its
+            workers between moves and games. Games play exactly the same either way
         """
+        self.rng = rng
+        self.cascade = cascade
+        self.sink = sink
+        self.game_id = new_game_id() if sink is not None else None
+        self.num_guesses = 0
+        self.max_seconds = max_seconds
+        self.snapshots = snapshots
         if isinstance(arg1, int) and isinstance(arg2, int):
             d, n = arg1, arg2
-            board, mines = generate_board(d, n)
+            board, mines = generate_board(d, n, rng)
         else:
             board, mines = arg1, arg2
         self.board = board
@@ -462,87 +1466,178 @@ class ImprovedAgent:
         self.dim = len(board)
         self.info = info
         self.viz = len(info) == 3
+        self.min_risk = min_risk
+        self.engine = ProbabilityEngine()
+
+        # The knowledge base lives for the whole game, and is only told about the cells that change
+        self.solver = ClueSolver(self.dim, self.info, backend, patterns, pattern_db, max_cells, executor)
+        cells = self.board.cells
+        # If the cell is a number, we can generate a clue
+        for i, j in np.argwhere(cells <= 8).tolist():
+            self.add_clue((i, j))
+
+        # Bonus: tell the solver the global mine count
+        if self.info[0] != -1:
+            hidden_cells = set(map(tuple, np.argwhere(cells == HIDDEN).tolist()))
+            mined_cells = int(np.count_nonzero((cells == FLAGGED) | (cells == EXPLODED)))
+            self.solver.set_global(self.info[0], hidden_cells, mined_cells)
+
+    def add_clue(self, coordinates):
+        """
+        Collects the clue given by a revealed number and sends it to the clue solver
+        :param coordinates: i, j tuple of a cell showing a number
+        :return: nothing
+        """
+        cells = self.board.cells.reshape(-1)
+        index = coordinates[0] * self.dim + coordinates[1]
+        hidden_cells = 0
+        mined_cells = 0
+        for neighbor in neighbor_table(self.dim).neighbor_indices(index):
+            cell = cells[neighbor]
+            # Count mined cells, add hidden cells to the bitset
+            if cell == FLAGGED or cell == EXPLODED:
+                mined_cells += 1
+            elif cell == HIDDEN:
+                hidden_cells |= 1 << neighbor
+            elif cell > 8:
+                raise Exception("Unexpected cell value: " + SYMBOLS[cell])
+        # Add new clue to the solver
+        self.solver.add_clue(int(cells[index]), hidden_cells, mined_cells, coordinates)
+
+    def update(self, coordinates):
+        """
+        Tells the clue solver that a hidden cell has just been revealed or flagged
+        :param coordinates: i, j tuple of the cell
+        :return: nothing
+        """
+        cell = self.board.cells[coordinates]
+        self.solver.resolve_cell(coordinates, cell == FLAGGED or cell == EXPLODED)
+        if cell <= 8:
+            self.add_clue(coordinates)
+
+    def reveal(self, coordinates):
+        """
+        Queries a hidden cell and tells the clue solver about every cell that got uncovered
+        :param coordinates: i, j tuple of the cell
+        :return: nothing
+        """
+        revealed = [] if self.cascade else None
+        self.board = query(coordinates, self.board, self.mines, revealed)
+        for pair in [divmod(index, self.dim) for index in revealed] if self.cascade else [coordinates]:
+            self.update(pair)
 
     def infer(self):
         """
-        Iterates through the current board and collects clue to send to the clue solver
-        Then, gets the solved clues and updates the board, repeating if needed
+        Asks the clue solver for new information and updates the board, repeating for as long as there is any. With
+        max_seconds, row reduction stops once this call has used up its time
         :return: The next cell to pick if needed
         """
-        solver = ClueSolver(self.dim, self.info)
-        for i in range(self.dim):
-            for j in range(self.dim):
-                # If the cell is a number, we can generate a clue
-                if self.board[i][j].isdigit():
-                    hidden_cells = set()
-                    mined_cells = 0
-                    for pair in get_neighbor_coordinates((i, j), self.dim):
-                        cell = self.board[pair[0]][pair[1]]
-                        # Count mined cells, add hidden cells to list
-                        if cell == 'M' or cell == 'X':
-                            mined_cells += 1
-                        elif cell == '?':
-                            hidden_cells.add(pair)
-                        elif not cell.isdigit():
-                            raise Exception("Unexpected cell value: " + cell)
-                    # Add new clue to the solver
-                    solver.add_clue(int(self.board[i][j]), hidden_cells, mined_cells)
-
-        # Bonus: add global information clue
-        if self.info[0] != -1:
-            hidden_cells = set()
-            mined_cells = 0
-            for i in range(self.dim):
-                for j in range(self.dim):
-                    if self.board[i][j] == '?':
-                        hidden_cells.add((i, j))
-                    if self.board[i][j] == 'M' or self.board[i][j] == 'X':
-                        mined_cells += 1
-            solver.add_clue(self.info[0], hidden_cells, mined_cells)
-
-        # Solves all clues
-        solution, next_cell = solver.solve()
-
-        # If we determine cells as mines, mark them as such
-        for pair in solution.mines:
-            self.board[pair[0]][pair[1]] = 'M'
-        # If we determine cells as safe, query them
-        for pair in solution.safe:
-            self.board = query(pair, self.board, self.mines)
-
-        # If doing play by play, print the board
-        if self.viz:
-            print("Clues")
-            print(solution)
-            print_board(self.board)
-
-        # If board has updated, infer again
-        if solution.has_new() and not completed(self.board):
-            next_cell = self.infer()
-
+        if self.sink is not None:
+            self.solver.stats = stats = dict.fromkeys(INFER_FIELDS, 0)
+            start = time.perf_counter()
+        if self.max_seconds is not None:
+            self.solver.deadline = time.perf_counter() + self.max_seconds
+        if self.snapshots is not None:
+            self.snapshots.record(self.solver)
+        while True:
+            # Solves all clues
+            solution, next_cell = self.solver.solve()
+
+            # If we determine cells as mines, mark them as such
+            for pair in solution.mine_cells():
+                self.board = flag(pair, self.board)
+                self.update(pair)
+            # If we determine cells as safe, query them, unless a cascade already did
+            for pair in solution.safe_cells():
+                if self.board.cells[pair] == HIDDEN:
+                    self.reveal(pair)
+
+            # If doing play by play, print the board
+            if self.viz:
+                print("Clues")
+                print(solution)
+                print_board(self.board)
+
+            # If board has updated, infer again
+            if not solution.has_new() or completed(self.board):
+                break
+
+        if self.sink is not None:
+            self.solver.stats = None
+            self.sink.emit(dict(stats, event='infer', game=self.game_id, time_s=time.perf_counter() - start))
         return next_cell
 
+    def guessed(self, kind, coordinates):
+        """
+        Counts a forced guess, and traces it if tracing is on.
+
+        :param kind: how the cell was picked, 'risk', 'random' or 'selection'
+        :param coordinates: i, j tuple of the cell guessed
+        :return: nothing
+        """
+        self.num_guesses += 1
+        if self.sink is not None:
+            self.sink.emit({'event': 'guess', 'game': self.game_id, 'kind': kind,
+                            'exploded': bool(self.board.cells[coordinates] == EXPLODED)})
+
+    def safest_cell(self):
+        """
+        Finds the hidden cell least likely to be a mine, using the mine counter that every game shows
+        :return: i, j tuple of the cell
+        """
+        cells = self.board.cells
+        num_mines = len(self.mines) - int(np.count_nonzero((cells == FLAGGED) | (cells == EXPLODED)))
+        probabilities, other = self.engine.probabilities(self.solver.clues.values(), len(self.board.hidden), num_mines)
+        if probabilities is None:
+            return divmod(self.board.hidden.pick(self.rng), self.dim)
+
+        best = min(probabilities, key=lambda index: (probabilities[index], index), default=None)
+        if best is not None and (other is None or probabilities[best] <= other):
+            return divmod(best, self.dim)
+        # Every cell away from the clues is equally likely, so take one at random
+        for _ in range(32):
+            index = self.board.hidden.pick(self.rng)
+            if index not in probabilities:
+                return divmod(index, self.dim)
+        return divmod((self.rng or random).choice([index for index in self.board.hidden
+                                                   if index not in probabilities]), self.dim)
+
     def run(self):
         """
         Runs improved agent on the minesweeper board, and prints final score.
 
         :return: nothing
         """
+        start = time.perf_counter()
         while not completed(self.board):
             # Infer for as long as we can
             next_cell = self.infer()
             # No new info able to be inferred, query a cell
             if not completed(self.board):
                 # reveal random cell and update info
-                if not self.info[1] or next_cell == (-1, -1):
+                if self.min_risk:
+                    # Query the cell least likely to be a mine
+                    i, j = self.safest_cell()
+                    self.reveal((i, j))
+                    self.guessed('risk', (i, j))
+                    if self.viz:
+                        print("Forced to guess: " + str(i) + " " + str(j))
+                        print_board(self.board)
+                elif not self.info[1] or next_cell == (-1, -1):
                     # Query a random cell
-                    self.board, (i, j) = random_query(self.board, self.mines)
+                    i, j = divmod(self.board.hidden.pick(self.rng), self.dim)
+                    self.reveal((i, j))
+                    self.guessed('random', (i, j))
                     if self.viz:
                         print("Forced to guess: " + str(i) + " " + str(j))
                         print_board(self.board)
                 else:
                     # Bonus: query the cell given by our solver as the best pick
-                    query(next_cell, self.board, self.mines)
+                    self.reveal(next_cell)
+                    self.guessed('selection', next_cell)
 
         self.score = get_score(self.board, self.mines)
+        if self.sink is not None:
+            self.sink.emit({'event': 'game', 'game': self.game_id, 'dim': self.dim, 'mines': len(self.mines),
+                            'score': self.score, 'guesses': self.num_guesses, 'time_s': time.perf_counter() - start})
         # print('Score: ' + str(self.score))